@@ -1,40 +1,131 @@
+import hashlib
 import json
+import multiprocessing
+import os
+import random
+import resource
 import time
 from collections import defaultdict
 from tqdm import tqdm
 
-from nonograms.solve import NonogramProblem
+from nonograms.data import GridData
+from nonograms.solve import NonogramProblem, create_problem, count_solutions
+from nonograms.line_solver import FullLineSolver
+from nonograms.nonogram import Grid
+from nonograms.cache import LineCache
+from nonograms.stats import SolverStats
+from nonograms.parallel import WorkerPool
+from nonograms.portfolio import Portfolio
+from nonograms.split import SplitSearch
+from nonograms.util import Budget, BudgetException, InconsistencyException, TimeoutException
 
 class NonogramsBenchmark:
     def __init__(self, data):
         self.data = data
 
-    def test(self, timeout=None):
+    def test(self, timeout=None, jobs=1, cache_size=None, share_cache=False, count=None,
+             stats=False, portfolio=None, split=None, checkpoints=None, resume=False,
+             max_nodes=None, max_memory=None, **options):
         self.timeout = timeout
+        self.count = count
+        if resume:
+            # Only the puzzles that timed out last time, from where they stopped
+            self.data = list(checkpointed_grids(self.data, checkpoints))
         print('Timing performance on %s puzzles...' % len(self.data))
         self.results = {}
+        self.cache_size = cache_size
+        self.cache_totals = defaultdict(lambda: 0)
         try:
-            for grid in tqdm(self.data, smoothing=0):
-                grid.clear()
-                problem = NonogramProblem(grid)
-                start_time = time.clock()
-                try:
-                    problem.solve(abort_time=(start_time + timeout if timeout else None))
-                    solve_time = time.clock() - start_time
-                    self.report_result(grid.nid, solve_time)
-                except RuntimeError as e:
-                    self.report_result(grid.nid, error=e)
+            if portfolio:
+                self.test_portfolio(portfolio, timeout, count)
+            elif split:
+                self.test_split(split, timeout, count, options)
+            elif jobs > 1:
+                self.test_parallel(jobs, timeout, cache_size, share_cache, count, stats,
+                                   checkpoints, resume, max_nodes, max_memory, options)
+            else:
+                for grid in tqdm(self.data, smoothing=0):
+                    self.add_result(grid.nid, *solve_puzzle(grid, timeout, cache_size,
+                                                            share_cache, options, count, stats,
+                                                            checkpoints, resume, max_nodes,
+                                                            max_memory))
         except KeyboardInterrupt:
             # We're done here anyway, so finish up and possibly report the results
             pass
 
-    def report_result(self, nid, time=None, error=None):
-        if error:
-            self.results[nid] = { 'time': time, 'error': type(error).__name__ }
-        else:
-            self.results[nid] = { 'time': time }
+    def test_parallel(self, jobs, timeout, cache_size, share_cache, count, stats, checkpoints,
+                      resume, max_nodes, max_memory, options):
+        tasks = ((grid.nid, (grid.serialize(solution=False), grid.nid, timeout, cache_size, share_cache,
+                             options, count, stats, checkpoints, resume, max_nodes, max_memory))
+                 for grid in self.data)
+        # Workers enforce the timeout themselves, this only catches runaways
+        pool = WorkerPool(solve_serialized_puzzle, jobs,
+                          timeout=(timeout * KILL_TIMEOUT_FACTOR + 1 if timeout else None))
+        try:
+            for nid, outcome in tqdm(pool.imap_unordered(tasks), total=len(self.data), smoothing=0):
+                if outcome is None:
+                    self.report_result(nid, error=TimeoutException())
+                else:
+                    self.add_result(nid, *outcome)
+        finally:
+            pool.close()
 
-    def report(self):
+    # Races the configurations on each puzzle in turn, and records the winner
+    def test_portfolio(self, configurations, timeout, count):
+        portfolio = Portfolio(configurations, timeout=timeout, count=count,
+                              kill_timeout=timeout * KILL_TIMEOUT_FACTOR + 1 if timeout else None)
+        try:
+            for grid in tqdm(self.data, smoothing=0):
+                start_time = time.time()
+                winner, outcome = portfolio.solve(grid)
+                if outcome is None:
+                    self.report_result(grid.nid, error=TimeoutException())
+                    continue
+                result = dict(outcome)
+                result.pop('grid', None)
+                result['winner'] = winner
+                # Including starting the race and cancelling the rest
+                result['race_time'] = time.time() - start_time
+                self.results[grid.nid] = result
+        finally:
+            portfolio.close()
+
+    # Splits the search for each puzzle in turn across the workers. Times are
+    # wall clock times, since the work is done in other processes.
+    def test_split(self, jobs, timeout, count, options):
+        for grid in tqdm(self.data, smoothing=0):
+            search = SplitSearch(grid, jobs, count=count, **options)
+            start_time = time.time()
+            try:
+                solutions = search.solve(timeout)
+                result = result_entry(time.time() - start_time,
+                                      branching_attempts=search.branching_attempts,
+                                      line_solves=search.line_solves,
+                                      steps=search.steps,
+                                      solutions=solutions if count is not None else None)
+            except RuntimeError as e:
+                result = result_entry(error=e,
+                                      branching_attempts=search.branching_attempts,
+                                      line_solves=search.line_solves,
+                                      steps=search.steps)
+            result['tasks_run'] = search.tasks_run
+            result['tasks_split'] = search.tasks_split
+            self.results[grid.nid] = result
+
+    def add_result(self, nid, result, cache_stats):
+        self.results[nid] = result
+        for key, value in cache_stats.items():
+            self.cache_totals[key] += value
+
+    def report_result(self, nid, time=None, error=None, **counters):
+        self.results[nid] = result_entry(time, error, **counters)
+
+    @staticmethod
+    def load_results(filename):
+        with open(filename, 'r') as f:
+            return json.load(f)['results']
+
+    def report(self, baseline=None):
         completed_times = []
         errors = defaultdict(lambda: 0)
         for result in self.results.values():
@@ -44,19 +135,554 @@ class NonogramsBenchmark:
                 completed_times.append(result['time'])
         completed_times.sort()
 
-        print('Mean solve time:   %s' % (sum(completed_times) / len(completed_times)))
-        print('Median solve time: %s' % completed_times[len(completed_times)/2])
-        print('Max solve time:    %s' % max(completed_times))
+        print('Timeouts: %s' % errors.get('TimeoutException', 0))
+        if completed_times:
+            print('Mean solve time:   %s' % (sum(completed_times) / len(completed_times)))
+            print('Median solve time: %s' % completed_times[len(completed_times)/2])
+            print('Max solve time:    %s' % max(completed_times))
         print('Completed: %s' % len(completed_times))
         print('Errors: %s' % sum(errors.values()))
         for error, count in errors.items():
             print('  %s: %s' % (error, count))
+        resolved = [result['resolved'] for result in self.results.values() if 'resolved' in result]
+        if resolved:
+            print('Resolved before running out: %.1f%% of the cells on average' % (
+                100 * sum(resolved) / len(resolved)))
+        print('Branching attempts: %s' % sum(result.get('branching_attempts') or 0
+                                             for result in self.results.values()
+                                             if 'error' not in result))
+        print('Line solves:        %s' % sum(result.get('line_solves') or 0
+                                             for result in self.results.values()
+                                             if 'error' not in result))
+        print('Steps:              %s' % sum(result.get('steps') or 0
+                                             for result in self.results.values()
+                                             if 'error' not in result))
+        if self.count is not None:
+            solutions = [result.get('solutions') for result in self.results.values()
+                         if 'error' not in result]
+            print('Unique: %s' % solutions.count(1))
+            print('Ambiguous: %s%s' % (sum(1 for found in solutions if found > 1),
+                                       ' (stopped at %s solutions)' % self.count
+                                       if self.count > 1 else ''))
+            print('No solution: %s' % solutions.count(0))
+        winners = defaultdict(lambda: 0)
+        for result in self.results.values():
+            if result.get('winner'):
+                winners[result['winner']] += 1
+        if winners:
+            print('Portfolio wins:')
+            for name, wins in sorted(winners.items(), key=lambda item: -item[1]):
+                print('  %s: %s' % (name, wins))
+        if self.cache_size:
+            stats = self.cache_stats()
+            print('Line cache: %s hits, %s misses, %s evictions (%.1f%% hit rate)' % (
+                stats['hits'], stats['misses'], stats['evictions'], 100 * stats['hit_rate']))
+        if baseline:
+            self.report_baseline(baseline)
+
+    def cache_stats(self):
+        stats = dict(self.cache_totals)
+        lookups = stats.get('hits', 0) + stats.get('misses', 0)
+        stats['size'] = self.cache_size
+        stats['hit_rate'] = float(stats.get('hits', 0)) / lookups if lookups else 0.0
+        return stats
+
+    def report_baseline(self, baseline):
+        print('Timeouts compared to baseline: %s vs %s' % (
+            sum(1 for result in self.results.values() if result.get('error') == 'TimeoutException'),
+            sum(1 for result in baseline.values() if result.get('error') == 'TimeoutException')))
+        # Only compare puzzles that both runs completed
+        compared = [(result, baseline[str(nid)]) for nid, result in self.results.items()
+                    if str(nid) in baseline and
+                    'error' not in result and 'error' not in baseline[str(nid)]]
+        if not compared:
+            print('No puzzles completed in both runs to compare against')
+            return
+        print('Compared to baseline on %s puzzles completed by both:' % len(compared))
+        for key, label in [('time', 'Total solve time:'),
+                           ('steps', 'Steps:'),
+                           ('branching_attempts', 'Branching attempts:'),
+                           ('line_solves', 'Line solves:')]:
+            pairs = [(ours[key], theirs[key]) for ours, theirs in compared
+                     if ours.get(key) is not None and theirs.get(key) is not None]
+            if pairs:
+                ours = sum(pair[0] for pair in pairs)
+                theirs = sum(pair[1] for pair in pairs)
+                print('  %-20s %s vs %s%s' % (label, ours, theirs, percent_change(ours, theirs)))
+        print('  %-20s %s vs %s' % ('Puzzles that branch:',
+                                   sum(1 for ours, _ in compared if ours.get('branching_attempts')),
+                                   sum(1 for _, theirs in compared if theirs.get('branching_attempts'))))
+
+    def save(self, filename):
+        print('Saving results to %s' % filename)
+        with open(filename, 'w') as f:
+            json.dump({
+                'timeout': self.timeout,
+                'count': self.count,
+                'results': self.results,
+                'line_cache': self.cache_stats() if self.cache_size else None,
+            }, f)
+
+
+KILL_TIMEOUT_FACTOR = 3
+CACHE_COUNTERS = ('hits', 'misses', 'evictions')
+
+_shared_cache = None
+
+def line_cache(cache_size, share_cache):
+    global _shared_cache
+    if not cache_size:
+        return None
+    if not share_cache:
+        return LineCache(cache_size)
+    if _shared_cache is None:
+        _shared_cache = LineCache(cache_size)
+    return _shared_cache
+
+# With a checkpoint directory, puzzles that run out of time (or nodes or
+# memory) are saved there to be resumed later. The times and counters of a
+# resumed puzzle include the work done before it was checkpointed. Puzzles
+# that run out record how far they got.
+def solve_puzzle(grid, timeout, cache_size, share_cache, options, count=None, stats=False,
+                 checkpoints=None, resume=False, max_nodes=None, max_memory=None):
+    cache = line_cache(cache_size, share_cache)
+    counters_before = [getattr(cache, counter) for counter in CACHE_COUNTERS] if cache is not None else None
+    problem = create_problem(grid, line_cache=cache, **options)
+    earlier_time = earlier_wall_time = 0
+    if resume:
+        checkpoint = load_checkpoint(checkpoint_path(checkpoints, grid.nid))
+        problem.restore(checkpoint)
+        earlier_time = checkpoint['time']
+        earlier_wall_time = checkpoint['wall_time']
+    solver_stats = SolverStats(problem) if stats else None
+    start_time = time.clock()
+    start_wall_time = time.time()
+    budget = Budget(start_time + timeout if timeout else None, max_nodes, max_memory)
+    try:
+        if count is not None:
+            solutions = count_solutions(problem, limit=count, budget=budget)
+        else:
+            problem.solve(budget=budget)
+            solutions = None
+        result = result_entry(earlier_time + time.clock() - start_time,
+                              branching_attempts=problem.branching_attempts,
+                              line_solves=problem.line_solves,
+                              steps=problem.steps,
+                              solutions=solutions)
+        result['wall_time'] = earlier_wall_time + time.time() - start_wall_time
+        if resume:
+            os.remove(checkpoint_path(checkpoints, grid.nid))
+    except RuntimeError as e:
+        result = result_entry(error=e,
+                              branching_attempts=problem.branching_attempts,
+                              line_solves=problem.line_solves,
+                              steps=problem.steps)
+        if isinstance(e, BudgetException):
+            progress = problem.progress()
+            for key in ('determined', 'settled', 'resolved', 'depth'):
+                result[key] = progress[key]
+        if checkpoints and isinstance(e, BudgetException):
+            checkpoint = problem.checkpoint()
+            checkpoint['time'] = earlier_time + time.clock() - start_time
+            checkpoint['wall_time'] = earlier_wall_time + time.time() - start_wall_time
+            save_checkpoint(checkpoint_path(checkpoints, grid.nid), checkpoint)
+    if resume:
+        result['resumed'] = True
+    if solver_stats is not None:
+        result['stats'] = solver_stats.report()
+    cache_stats = {}
+    if cache is not None:
+        for counter, before in zip(CACHE_COUNTERS, counters_before):
+            cache_stats[counter] = getattr(cache, counter) - before
+    return result, cache_stats
+
+def solve_serialized_puzzle(data, nid, timeout, cache_size, share_cache, options, count=None,
+                            stats=False, checkpoints=None, resume=False, max_nodes=None,
+                            max_memory=None):
+    return solve_puzzle(Grid.deserialize(data, nid=nid), timeout, cache_size, share_cache, options,
+                        count, stats, checkpoints, resume, max_nodes, max_memory)
+
+def checkpoint_path(checkpoints, nid):
+    return os.path.join(checkpoints, '%s.json' % nid)
+
+# The puzzles that have a checkpoint, read by id so that the rest of the
+# corpus isn't read at all
+def checkpointed_grids(data, checkpoints):
+    grid_filter = data.grid_filter
+    for filename in sorted(os.listdir(checkpoints)):
+        nid, extension = os.path.splitext(filename)
+        if extension != '.json':
+            continue
+        if grid_filter is not None and not grid_filter.accepts_nid(nid):
+            continue
+        try:
+            grid = data.get(nid)
+        except KeyError:
+            continue
+        if grid_filter is None or grid_filter.accepts_size(grid.width, grid.height):
+            yield grid
+
+def load_checkpoint(filename):
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+def save_checkpoint(filename, checkpoint):
+    # Write the whole thing before replacing an older checkpoint
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(checkpoint, f)
+    os.rename(filename + '.tmp', filename)
+
+def result_entry(time=None, error=None, branching_attempts=None, line_solves=None, steps=None,
+                 solutions=None):
+    if error:
+        result = { 'time': time, 'error': type(error).__name__ }
+    else:
+        result = { 'time': time }
+    result['branching_attempts'] = branching_attempts
+    result['line_solves'] = line_solves
+    result['steps'] = steps
+    if solutions is not None:
+        result['solutions'] = solutions
+    return result
+
+def percent_change(value, baseline):
+    if not baseline:
+        return ''
+    return ' (%+.1f%%)' % (100.0 * (value - baseline) / baseline)
+
+
+# Runs a fixed sample of puzzles, picked per size and difficulty bucket, a
+# few times each so runs of different solver versions can be compared
+class BenchmarkSuite:
+    def __init__(self, data, per_bucket=None, seed=''):
+        self.data = data
+        self.per_bucket = per_bucket
+        self.seed = seed
+
+    def select(self):
+        print('Bucketing %s puzzles...' % len(self.data))
+        buckets = defaultdict(list)
+        for grid in tqdm(self.data, smoothing=0):
+            buckets[bucket(grid)].append((sample_key(grid.nid, self.seed), str(grid.nid)))
+        self.puzzles = {}
+        for name, keys in buckets.items():
+            keys.sort()
+            for _, nid in keys[:self.per_bucket]:
+                self.puzzles[nid] = name
+
+    def test(self, timeout=None, warmup=1, repeats=3, **options):
+        self.timeout = timeout
+        self.warmup = warmup
+        self.repeats = repeats
+        print('Timing %s puzzles, %s times each...' % (len(self.puzzles), repeats))
+        self.results = {}
+        try:
+            for nid in tqdm(sorted(self.puzzles, key=sort_key), smoothing=0):
+                grid = self.data.get(nid)
+                for _ in xrange(warmup):
+                    solve_puzzle(grid, timeout, None, False, options)
+                runs = [solve_puzzle(grid, timeout, None, False, options)[0]
+                        for _ in xrange(repeats)]
+                self.results[nid] = suite_entry(self.puzzles[nid], runs)
+        except KeyboardInterrupt:
+            pass
+
+    def report(self):
+        print('%-16s %6s %8s %10s %10s %10s %10s %10s' % (
+            'Bucket', 'Count', 'Timeouts', 'Wall p50', 'Wall p90', 'Wall p99', 'Wall max',
+            'CPU p50'))
+        for name, results in sorted(group_by_bucket(self.results).items()):
+            completed = [result for result in results if 'error' not in result]
+            wall_times = sorted(result['wall_time'] for result in completed)
+            cpu_times = sorted(result['time'] for result in completed)
+            print('%-16s %6s %8s %10s %10s %10s %10s %10s' % (
+                name, len(results),
+                sum(1 for result in results if result.get('error') == 'TimeoutException'),
+                format_time(percentile(wall_times, 50)),
+                format_time(percentile(wall_times, 90)),
+                format_time(percentile(wall_times, 99)),
+                format_time(wall_times[-1] if wall_times else None),
+                format_time(percentile(cpu_times, 50))))
 
     def save(self, filename):
         print('Saving results to %s' % filename)
         with open(filename, 'w') as f:
             json.dump({
                 'timeout': self.timeout,
-                'results': self.results
+                'suite': {
+                    'per_bucket': self.per_bucket,
+                    'seed': self.seed,
+                    'warmup': self.warmup,
+                    'repeats': self.repeats,
+                },
+                'results': self.results,
             }, f)
 
+
+SIZE_BUCKETS = (10, 20, 30)
+
+# Puzzles are bucketed by their largest side and by how much of them line
+# solving alone can fill in: all of it, most of it or less than half
+def bucket(grid):
+    size = max(grid.width, grid.height)
+    for limit in SIZE_BUCKETS:
+        if size <= limit:
+            size_name = '<=%s' % limit
+            break
+    else:
+        size_name = '>%s' % SIZE_BUCKETS[-1]
+
+    problem = NonogramProblem(grid, line_solver=FullLineSolver)
+    cells = grid.width * grid.height
+    if not problem.propagate() or problem.blank_count > cells / 2:
+        difficulty = 'search'
+    elif problem.blank_count:
+        difficulty = 'partial'
+    else:
+        difficulty = 'lines'
+    return '%s %s' % (size_name, difficulty)
+
+# A stable pseudo-random order, so the same puzzles get picked on every run
+# and a growing corpus only adds to the sample
+def sample_key(nid, seed):
+    return hashlib.md5('%s:%s' % (seed, nid)).hexdigest()
+
+def sort_key(nid):
+    return (0, int(nid)) if str(nid).isdigit() else (1, nid)
+
+# Keeps the median of the repeated runs as the puzzle's time, and every run
+def suite_entry(name, runs):
+    entry = dict(runs[len(runs) / 2])
+    entry['bucket'] = name
+    completed = [run for run in runs if 'error' not in run]
+    if completed:
+        entry.pop('error', None)
+        entry['time'] = median(run['time'] for run in completed)
+        entry['wall_time'] = median(run['wall_time'] for run in completed)
+        entry['times'] = [run['time'] for run in completed]
+        entry['wall_times'] = [run['wall_time'] for run in completed]
+    entry['runs'] = len(runs)
+    entry['completed_runs'] = len(completed)
+    return entry
+
+def group_by_bucket(results):
+    groups = defaultdict(list)
+    for result in results.values():
+        groups[result.get('bucket', 'all')].append(result)
+    return groups
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) / 2]
+
+# Nearest-rank percentile of sorted values
+def percentile(values, rank):
+    if not values:
+        return None
+    index = max(int(-(-rank * len(values) // 100)) - 1, 0)
+    return values[index]
+
+def format_time(value):
+    return '-' if value is None else '%.4f' % value
+
+
+# Compares two saved results files puzzle by puzzle. A puzzle regresses when
+# it stops completing, or its time grows by more than the threshold (a
+# fraction) and by more than min_time seconds, so tiny puzzles don't trip
+# it on noise.
+class ResultsComparison:
+    def __init__(self, baseline_file, results_file, threshold=0.1, min_time=0.005,
+                 key='wall_time'):
+        with open(baseline_file, 'r') as f:
+            self.baseline = json.load(f)['results']
+        with open(results_file, 'r') as f:
+            self.results = json.load(f)['results']
+        self.threshold = threshold
+        self.min_time = min_time
+        self.key = key
+
+    def compare(self):
+        self.regressions = []
+        self.improvements = []
+        # A puzzle that didn't get run (say the run was interrupted) can't be
+        # shown not to have regressed, but new puzzles are fine
+        self.added = sorted(set(self.results) - set(self.baseline), key=sort_key)
+        for nid in sorted(set(self.baseline) - set(self.results), key=sort_key):
+            self.regressions.append((nid, self.baseline[nid].get('bucket'),
+                                     'missing from the results'))
+        for nid in sorted(set(self.baseline) & set(self.results), key=sort_key):
+            theirs = self.baseline[nid]
+            ours = self.results[nid]
+            if 'error' in ours and 'error' not in theirs:
+                self.regressions.append((nid, ours.get('bucket'), 'now fails with %s' % ours['error']))
+            elif 'error' in theirs and 'error' not in ours:
+                self.improvements.append((nid, ours.get('bucket'), 'now completes'))
+            elif 'error' not in ours:
+                ours_time = self.time(ours)
+                theirs_time = self.time(theirs)
+                change = '%s -> %s%s' % (format_time(theirs_time), format_time(ours_time),
+                                         percent_change(ours_time, theirs_time))
+                if self.significant(ours_time, theirs_time):
+                    self.regressions.append((nid, ours.get('bucket'), change))
+                elif self.significant(theirs_time, ours_time):
+                    self.improvements.append((nid, ours.get('bucket'), change))
+        return not self.regressions
+
+    def time(self, result):
+        # Plain benchmark runs only have CPU time
+        return result.get(self.key, result['time'])
+
+    def significant(self, value, baseline):
+        return value - baseline > max(self.threshold * baseline, self.min_time)
+
+    def report(self):
+        for name, results in sorted(group_by_bucket(self.results).items()):
+            nids = [nid for nid, result in self.results.items()
+                    if result.get('bucket', 'all') == name and nid in self.baseline and
+                    'error' not in result and 'error' not in self.baseline[nid]]
+            ours = sum(self.time(self.results[nid]) for nid in nids)
+            theirs = sum(self.time(self.baseline[nid]) for nid in nids)
+            print('%-16s %4s puzzles  %s -> %s%s' % (name, len(nids), format_time(theirs),
+                                                    format_time(ours), percent_change(ours, theirs)))
+        if self.added:
+            print('%s puzzles are only in the new results' % len(self.added))
+        print('Improvements: %s' % len(self.improvements))
+        print('Regressions: %s (threshold %+.0f%% and %ss)' % (len(self.regressions),
+                                                              100 * self.threshold, self.min_time))
+        for nid, name, change in self.regressions:
+            print('  %s (%s): %s' % (nid, name or 'all', change))
+
+
+class LineSolverBenchmark:
+    def __init__(self, data, samples=10, seed=0):
+        self.data = data
+        self.samples = samples
+        self.seed = seed
+
+    def collect(self):
+        print('Sampling partially solved lines from %s puzzles...' % len(self.data))
+        rng = random.Random(self.seed)
+        self.cases = []
+        for grid in tqdm(self.data, smoothing=0):
+            solution = grid.solution
+            if solution is None:
+                continue
+            problem = NonogramProblem(grid)
+            for constraint in problem.constraints:
+                line = [solution[cell.y][cell.x] for cell in constraint.cells]
+                for _ in xrange(self.samples):
+                    known = rng.random()
+                    states = [bool(value) if rng.random() < known else None for value in line]
+                    self.cases.append((constraint, states))
+
+    # Synthetic lines instead of ones from the corpus, see adversarial_line
+    def collect_adversarial(self):
+        print('Generating %s lines of each kind...' % (self.samples * 10))
+        rng = random.Random(self.seed)
+        self.cases = []
+        for kind in ADVERSARIAL_LINES:
+            for _ in xrange(self.samples * 10):
+                runs, states = adversarial_line(rng, kind)
+                grid = Grid(len(states), 1, rows=[runs], columns=[[]] * len(states))
+                self.cases.append((NonogramProblem(grid).constraints[0], states))
+
+    def test(self, line_solvers):
+        self.results = {}
+        outputs = {}
+        for name, line_solver in line_solvers:
+            start_time = time.clock()
+            outputs[name] = self._run(line_solver)
+            solve_time = time.clock() - start_time
+            self.results[name] = { 'time': solve_time }
+
+        # Restoring the sampled states costs the same for every solver, so
+        # leave it out of the throughput numbers
+        start_time = time.clock()
+        self._run(None)
+        overhead = time.clock() - start_time
+        reference_name = line_solvers[0][0]
+        for name, result in self.results.items():
+            result['time'] = max(result['time'] - overhead, 1e-9)
+            result['mismatches'] = sum(1 for ours, theirs in
+                                       zip(outputs[name], outputs[reference_name])
+                                       if ours != theirs)
+
+    def _run(self, line_solver):
+        outputs = []
+        for constraint, states in self.cases:
+            for cell, state in zip(constraint.cells, states):
+                cell.state = state
+            if line_solver:
+                try:
+                    line_solver(constraint.cells, constraint.direction).solve(constraint.proj)
+                    outputs.append(tuple(cell.state for cell in constraint.cells))
+                except InconsistencyException:
+                    outputs.append(None)
+        return outputs
+
+    def report(self):
+        print('Lines: %s' % len(self.cases))
+        for name, result in sorted(self.results.items(), key=lambda item: item[1]['time']):
+            print('%-10s %12.0f lines/s  (%s mismatches)' % (name,
+                                                            len(self.cases) / result['time'],
+                                                            result['mismatches']))
+
+
+ADVERSARIAL_LINES = ('short-runs', 'many-spans', 'contradiction')
+
+# Lines of 100 to 200 cells that are hard on placement searches: many runs of
+# one or two cells with some cells known, lines broken up into many spans by
+# crossed out cells, and short runs with one known cell wrong, so that every
+# placement has to be ruled out
+def adversarial_line(rng, kind):
+    length = rng.randint(100, 200)
+    if kind == 'many-spans':
+        line = [int(rng.random() < 0.5) for _ in xrange(length)]
+        states = [None if value else (False if rng.random() < 0.6 else None) for value in line]
+    else:
+        line = []
+        while len(line) < length:
+            line += [1] * rng.randint(1, 2) + [0] * rng.randint(1, 2)
+        line = line[:length]
+        states = [bool(value) if rng.random() < 0.2 else None for value in line]
+        if kind == 'contradiction':
+            i = rng.randrange(length)
+            states[i] = not line[i]
+    return Grid(length, 1, [line]).rows[0], states
+
+
+class LoadBenchmark:
+    def __init__(self, filenames, nid):
+        self.filenames = filenames
+        self.nid = nid
+
+    def test(self):
+        self.results = []
+        for filename in self.filenames:
+            # Measure each file in a fresh process so memory doesn't carry over
+            pool = multiprocessing.Pool(1)
+            try:
+                self.results.append((filename, pool.apply(measure_load, (filename, self.nid))))
+            finally:
+                pool.terminate()
+
+    def report(self):
+        print('%-40s %10s %10s %10s' % ('File', 'Load (s)', 'Get (s)', 'RSS (MB)'))
+        for filename, result in self.results:
+            print('%-40s %10.4f %10.4f %10.1f' % (filename, result['load_time'],
+                                                  result['get_time'], result['rss'] / 1024.0))
+
+
+def measure_load(filename, nid):
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start_time = time.time()
+    data = GridData.load(filename)
+    load_time = time.time() - start_time
+    start_time = time.time()
+    data.get(nid)
+    get_time = time.time() - start_time
+    return {
+        'load_time': load_time,
+        'get_time': get_time,
+        'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before,
+    }
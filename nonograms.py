@@ -1,10 +1,23 @@
 import argparse
+import os
+import sys
 import time
 
-from nonograms.data import GridData, RandomGridData, NONOGRAMS_PATH
+from nonograms.data import (GridData, GridFilter, BinaryGridData, JsonGridData, JsonLinesGridData,
+                            RandomGridData, NONOGRAMS_PATH)
 from nonograms.view import GuiView
-from nonograms.solve import NonogramProblem
-from benchmark import NonogramsBenchmark
+from nonograms.solve import create_problem, count_solutions
+from nonograms.line_solver import LINE_SOLVERS
+from nonograms.cache import LineCache
+from nonograms.schedule import QUEUES
+from nonograms.stats import SolverStats
+from nonograms.branch import BRANCHERS, VALUE_ORDERS
+from nonograms.portfolio import Portfolio, PORTFOLIO
+from nonograms.split import SplitSearch
+from nonograms.util import Budget, BudgetException, InconsistencyException, TimeoutException
+from serve import PuzzleService
+from benchmark import (NonogramsBenchmark, BenchmarkSuite, ResultsComparison, LineSolverBenchmark,
+                       LoadBenchmark, KILL_TIMEOUT_FACTOR)
 
 def view(args):
     data = GridData.load(args.file)
@@ -17,23 +30,354 @@ def solve(args):
     else:
         data = GridData.load(args.file)
     grid = data.get(args.id)
-    grid.clear()
-    problem = NonogramProblem(grid)
+    check_budget_arguments(args)
+    if args.portfolio is not None:
+        solve_portfolio(grid, portfolio_configurations(args), solution_limit(args), args.timeout)
+        return
+    if args.split:
+        solve_split(grid, args.split, split_options(args), solution_limit(args), args.timeout)
+        return
+    problem = create_problem(grid, **solver_options(args))
+    stats = SolverStats(problem) if args.stats else None
     if args.graphics:
         GuiView(grid, scale=args.size)
     else:
         start_time = time.clock()
-        problem.solve()
-        print('Solved in %s seconds with %s branching attempts' % (time.clock() - start_time,
-                                                                   problem.branching_attempts))
+        budget = Budget(start_time + args.timeout if args.timeout else None,
+                        args.max_nodes, args.max_memory)
+        count = solution_limit(args)
+        try:
+            if count is not None:
+                solutions = count_solutions(problem, limit=count, budget=budget)
+            else:
+                problem.solve(budget=budget)
+        except BudgetException as e:
+            progress = problem.progress()
+            print('Stopped (%s) after %s seconds with %s branching attempts, %s line solves and '
+                  '%s steps' % (type(e).__name__, time.clock() - start_time,
+                                progress['branching_attempts'], progress['line_solves'],
+                                progress['steps']))
+            print('%s of %s cells determined, %s of them (%.1f%%) without guessing, at depth %s' % (
+                progress['determined'], progress['cells'], progress['settled'],
+                100 * progress['resolved'], progress['depth']))
+            return
+        print('Solved in %s seconds with %s branching attempts, %s line solves and %s steps' % (
+            time.clock() - start_time, problem.branching_attempts, problem.line_solves,
+            problem.steps))
+        if count is not None:
+            print('Found %s solution%s%s' % (solutions, '' if solutions == 1 else 's',
+                                             ' (stopped there)' if solutions == count else ''))
+        if not grid.verify():
+            print('The solution does not match the clues!')
+        if stats is not None:
+            report = stats.report()
+            times = report.pop('times')
+            for key, value in sorted(report.items()):
+                print('%-24s %s' % (key + ':', value))
+            for phase, phase_time in sorted(times.items(), key=lambda item: -item[1]):
+                print('%-24s %.4f s' % (phase + ' time:', phase_time))
+        if problem.line_cache is not None:
+            stats = problem.line_cache.stats()
+            print('Line cache: %s hits, %s misses, %s evictions' % (stats['hits'],
+                                                                   stats['misses'],
+                                                                   stats['evictions']))
+
+def solve_portfolio(grid, configurations, count, timeout=None):
+    portfolio = Portfolio(configurations, timeout=timeout, count=count,
+                          kill_timeout=timeout * KILL_TIMEOUT_FACTOR + 1 if timeout else None)
+    start_time = time.time()
+    try:
+        winner, outcome = portfolio.solve(grid)
+    finally:
+        portfolio.close()
+    if winner is None:
+        print('No configuration finished in %s seconds' % (time.time() - start_time))
+        return
+    print('Solved by %s in %s seconds (%s seconds racing) with %s branching attempts, '
+          '%s line solves and %s steps' % (winner, outcome['time'], time.time() - start_time,
+                                           outcome['branching_attempts'], outcome['line_solves'],
+                                           outcome['steps']))
+    if outcome.get('error') == 'InconsistencyException':
+        print('The puzzle has no solution')
+        return
+    if count is not None:
+        solutions = outcome['solutions']
+        print('Found %s solution%s%s' % (solutions, '' if solutions == 1 else 's',
+                                         ' (stopped there)' if solutions == count else ''))
+    grid.grid = outcome['grid']
+    if not grid.verify():
+        print('The solution does not match the clues!')
+
+def solve_split(grid, jobs, options, count, timeout=None):
+    search = SplitSearch(grid, jobs, count=count, **options)
+    start_time = time.time()
+    try:
+        solutions = search.solve(timeout)
+    except InconsistencyException:
+        solutions = None
+    except TimeoutException:
+        print('Stopped (TimeoutException) after %s seconds with %s subproblems (%s of them split) '
+              'and %s branching attempts, %s line solves and %s steps in total' % (
+                  time.time() - start_time, search.tasks_run, search.tasks_split,
+                  search.branching_attempts, search.line_solves, search.steps))
+        return
+    print('Searched in %s seconds with %s subproblems (%s of them split) and %s branching '
+          'attempts, %s line solves and %s steps in total' % (
+              time.time() - start_time, search.tasks_run, search.tasks_split,
+              search.branching_attempts, search.line_solves, search.steps))
+    if solutions is None:
+        print('The puzzle has no solution')
+        return
+    if count is not None:
+        print('Found %s solution%s%s' % (solutions, '' if solutions == 1 else 's',
+                                         ' (stopped there)' if solutions == count else ''))
+    if not grid.verify():
+        print('The solution does not match the clues!')
 
 def benchmark(args):
-    benchmark = NonogramsBenchmark(GridData.load(args.file))
-    benchmark.test(timeout=args.timeout)
-    benchmark.report()
+    check_budget_arguments(args)
+    if args.checkpoints:
+        if (args.backend != 'objects' or solution_limit(args) is not None or
+                args.portfolio is not None or args.split):
+            raise ValueError('Only plain solves with the objects backend can be checkpointed')
+        if not os.path.isdir(args.checkpoints):
+            os.makedirs(args.checkpoints)
+    elif args.resume:
+        raise ValueError('--resume needs the --checkpoints directory to resume from')
+    benchmark = NonogramsBenchmark(GridData.load(args.file, grid_filter(args)))
+    options = solver_options(args)
+    options.pop('line_cache')
+    benchmark.test(timeout=args.timeout,
+                   jobs=args.jobs,
+                   cache_size=args.cache_size,
+                   share_cache=args.share_cache,
+                   count=solution_limit(args),
+                   stats=args.stats,
+                   portfolio=portfolio_configurations(args),
+                   split=args.split,
+                   checkpoints=args.checkpoints,
+                   resume=args.resume,
+                   max_nodes=args.max_nodes,
+                   max_memory=args.max_memory,
+                   **(split_options(args) if args.split else options))
+    benchmark.report(baseline=(NonogramsBenchmark.load_results(args.baseline)
+                               if args.baseline else None))
     if args.out:
         benchmark.save(args.out)
 
+def suite(args):
+    suite = BenchmarkSuite(GridData.load(args.file, grid_filter(args)), per_bucket=args.per_bucket, seed=args.seed)
+    suite.select()
+    options = solver_options(args)
+    options.pop('line_cache')
+    suite.test(timeout=args.timeout, warmup=args.warmup, repeats=args.repeats, **options)
+    suite.report()
+    if args.out:
+        suite.save(args.out)
+
+def compare(args):
+    comparison = ResultsComparison(args.baseline, args.results, threshold=args.threshold,
+                                   min_time=args.min_time,
+                                   key='time' if args.cpu_time else 'wall_time')
+    passed = comparison.compare()
+    comparison.report()
+    if not passed:
+        sys.exit(1)
+
+def serve(args):
+    options = solver_options(args)
+    options.pop('line_cache')
+    PuzzleService(jobs=args.jobs,
+                  timeout=args.timeout,
+                  cache_size=args.cache_size,
+                  count=solution_limit(args),
+                  **options).run()
+
+def linebench(args):
+    if args.adversarial:
+        benchmark = LineSolverBenchmark(None, samples=args.samples)
+        benchmark.collect_adversarial()
+    else:
+        benchmark = LineSolverBenchmark(GridData.load(args.file, grid_filter(args)),
+                                        samples=args.samples)
+        benchmark.collect()
+    names = args.line_solvers or sorted(LINE_SOLVERS, reverse=True)
+    benchmark.test([(name, LINE_SOLVERS[name]) for name in names])
+    benchmark.report()
+
+def convert(args):
+    data = GridData.load(args.file, grid_filter(args))
+    if args.out.endswith('.bin'):
+        BinaryGridData.write(args.out, data, grids=not args.no_grids, clues=not args.no_clues)
+    elif args.out.endswith('.json'):
+        if args.no_clues:
+            raise ValueError('JSON puzzle data always includes the clues')
+        converted = JsonGridData()
+        for grid in data:
+            converted.store(grid.nid, grid, solution=not args.no_grids)
+        converted.save(args.out)
+    elif args.out.endswith('.jsonl'):
+        if args.no_clues:
+            raise ValueError('JSON puzzle data always includes the clues')
+        JsonLinesGridData.write(args.out, data, solution=not args.no_grids)
+    else:
+        raise ValueError('Unspecified file format')
+    print('Wrote nonograms to %s' % args.out)
+
+def compact(args):
+    data = JsonLinesGridData(args.file)
+    dropped = data.compact()
+    print('Dropped %s superseded puzzles, %s left' % (dropped, len(data)))
+
+def loadbench(args):
+    benchmark = LoadBenchmark(args.files, args.id)
+    benchmark.test()
+    benchmark.report()
+
+def solver_options(args):
+    return {
+        'line_solver': LINE_SOLVERS[args.line_solver],
+        'line_cache': LineCache(args.cache_size) if args.cache_size else None,
+        'incremental': not args.no_incremental,
+        'queue': QUEUES[args.queue],
+        'brancher': BRANCHERS[args.branching],
+        'value_order': VALUE_ORDERS[args.value_order],
+        'learning': args.learning,
+        'backend': args.backend,
+    }
+
+def grid_filter(args):
+    if (args.min_size is None and args.max_size is None and
+            args.min_id is None and args.max_id is None):
+        return None
+    return GridFilter(min_size=args.min_size, max_size=args.max_size,
+                      min_nid=args.min_id, max_nid=args.max_id)
+
+def portfolio_configurations(args):
+    if args.portfolio is None:
+        return None
+    configurations = dict(PORTFOLIO)
+    for name in args.portfolio.split(','):
+        if name not in configurations:
+            raise ValueError('Unknown portfolio configuration: %s' % name)
+    return [(name, configurations[name]) for name in args.portfolio.split(',')]
+
+# Portfolios and split searches run in other processes, and only take a
+# timeout
+def check_budget_arguments(args):
+    if ((args.portfolio is not None or args.split) and
+            (args.max_nodes is not None or args.max_memory is not None)):
+        raise ValueError('--max-nodes and --max-memory can\'t be used with --portfolio or '
+                         '--split, only a timeout')
+
+# The split search runs the object backend in every worker, without a cache
+def split_options(args):
+    if args.backend != 'objects':
+        raise ValueError('The split search only works with the objects backend')
+    options = solver_options(args)
+    del options['line_cache']
+    del options['backend']
+    return options
+
+def solution_limit(args):
+    if args.unique:
+        return 2
+    return args.count
+
+def add_solver_arguments(parser):
+    parser.add_argument('-l', '--line-solver',
+                        choices=sorted(LINE_SOLVERS),
+                        default='span',
+                        help='the line solving engine to use (default: span)')
+    parser.add_argument('-c', '--cache-size',
+                        default=None,
+                        type=int,
+                        help='cache up to this many line solutions (default: no cache)')
+    parser.add_argument('-q', '--queue',
+                        choices=sorted(QUEUES),
+                        default='fifo',
+                        help='the order to revisit changed lines in (default: fifo)')
+    parser.add_argument('--branching',
+                        choices=sorted(BRANCHERS),
+                        default='minfree',
+                        help='how to pick the cell to guess when stuck (default: minfree)')
+    parser.add_argument('--value-order',
+                        choices=sorted(VALUE_ORDERS),
+                        default='fill',
+                        help='which value to guess first (default: fill)')
+    parser.add_argument('--backend',
+                        choices=['objects', 'numpy'],
+                        default='objects',
+                        help='keep the board in cell objects, or in a NumPy array with rows and '
+                             'columns solved in batches (always complete line solving and '
+                             'minfree branching) (default: objects)')
+    parser.add_argument('--learning',
+                        action='store_true',
+                        help='learn from contradictions and backjump past unrelated guesses')
+    parser.add_argument('--count',
+                        default=None,
+                        type=int,
+                        help='keep searching for up to this many solutions (0: all of them)')
+    parser.add_argument('--stats',
+                        action='store_true',
+                        help='count and time what the solver spends its time on (slows it down)')
+    parser.add_argument('--unique',
+                        action='store_true',
+                        help='check whether the solution is unique (same as --count 2)')
+    parser.add_argument('--no-incremental',
+                        action='store_true',
+                        help='re-solve every changed line from scratch')
+
+def add_portfolio_argument(parser):
+    parser.add_argument('--portfolio',
+                        nargs='?',
+                        const=','.join(name for name, _ in PORTFOLIO),
+                        default=None,
+                        metavar='NAMES',
+                        help='race solver configurations in parallel processes and take the first '
+                             'to finish, ignoring the other solver options; a comma-separated '
+                             'selection of %s (default: all of them)' %
+                             ', '.join(name for name, _ in PORTFOLIO))
+
+def add_budget_arguments(parser):
+    parser.add_argument('--max-nodes',
+                        default=None,
+                        type=int,
+                        help='give up after this many branching attempts, counted from where '
+                             'a resumed puzzle left off (default: no limit)')
+    parser.add_argument('--max-memory',
+                        default=None,
+                        type=float,
+                        metavar='MB',
+                        help='give up once the process is using this much memory (default: no '
+                             'limit)')
+
+def add_split_argument(parser):
+    parser.add_argument('--split',
+                        default=None,
+                        type=int,
+                        metavar='JOBS',
+                        help='split the search for each puzzle into subproblems and solve them '
+                             'in this many worker processes (no line cache, and no learning)')
+
+def add_filter_arguments(parser):
+    parser.add_argument('--min-size',
+                        default=None,
+                        type=int,
+                        help='skip puzzles whose longer side is shorter than this')
+    parser.add_argument('--max-size',
+                        default=None,
+                        type=int,
+                        help='skip puzzles whose longer side is longer than this')
+    parser.add_argument('--min-id',
+                        default=None,
+                        type=int,
+                        help='skip puzzles with a lower ID than this')
+    parser.add_argument('--max-id',
+                        default=None,
+                        type=int,
+                        help='skip puzzles with a higher ID than this')
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Solve a nonogram.')
@@ -59,7 +403,7 @@ if __name__ == '__main__':
                              type=int,
                              help='the puzzle ID')
     parse_solve.add_argument('-f', '--file',
-                             default='data/nonograms.json',
+                             default=NONOGRAMS_PATH,
                              help='the puzzle data file to use (default: %s)' % NONOGRAMS_PATH)
     parse_solve.add_argument('-r', '--random',
                              type=int,
@@ -68,6 +412,15 @@ if __name__ == '__main__':
     parse_solve.add_argument('-g', '--graphics',
                              action='store_true',
                              help='show a GUI while solving')
+    parse_solve.add_argument('-t', '--timeout',
+                             default=None,
+                             type=float,
+                             help='give up after this many seconds and show how far it got '
+                                  '(default: none)')
+    add_solver_arguments(parse_solve)
+    add_budget_arguments(parse_solve)
+    add_portfolio_argument(parse_solve)
+    add_split_argument(parse_solve)
     parse_solve.set_defaults(func=solve)
 
     parse_solve.add_argument('-s', '--size',
@@ -78,7 +431,7 @@ if __name__ == '__main__':
     parse_benchmark = subparsers.add_parser('benchmark',
                                             help='time solving a set of puzzles')
     parse_benchmark.add_argument('-f', '--file',
-                                 default='data/nonograms.json',
+                                 default=NONOGRAMS_PATH,
                                  help='the puzzle data file to use (default: %s)' % NONOGRAMS_PATH)
     parse_benchmark.add_argument('-t', '--timeout',
                                  default=None,
@@ -87,8 +440,162 @@ if __name__ == '__main__':
     parse_benchmark.add_argument('-o', '--out',
                                  default=None,
                                  help='the file to output results to')
+    parse_benchmark.add_argument('-j', '--jobs',
+                                 default=1,
+                                 type=int,
+                                 help='number of worker processes to solve puzzles with (default: 1)')
+    parse_benchmark.add_argument('-b', '--baseline',
+                                 default=None,
+                                 help='a results file from an earlier run to compare against')
+    add_solver_arguments(parse_benchmark)
+    add_portfolio_argument(parse_benchmark)
+    add_split_argument(parse_benchmark)
+    add_budget_arguments(parse_benchmark)
+    parse_benchmark.add_argument('--share-cache',
+                                 action='store_true',
+                                 help='share the line cache across all puzzles')
+    parse_benchmark.add_argument('--checkpoints',
+                                 default=None,
+                                 metavar='DIR',
+                                 help='save where the search was for puzzles that time out in '
+                                      'this directory')
+    parse_benchmark.add_argument('--resume',
+                                 action='store_true',
+                                 help='only run the puzzles with checkpoints, carrying on from '
+                                      'where they timed out')
+    add_filter_arguments(parse_benchmark)
     parse_benchmark.set_defaults(func=benchmark)
 
 
+    # nonograms.py suite ...
+    parse_suite = subparsers.add_parser('suite',
+                                        help='time a fixed sample of puzzles per size and difficulty')
+    parse_suite.add_argument('-f', '--file',
+                             default=NONOGRAMS_PATH,
+                             help='the puzzle data file to use (default: %s)' % NONOGRAMS_PATH)
+    parse_suite.add_argument('-p', '--per-bucket',
+                             default=None,
+                             type=int,
+                             help='puzzles to sample from each bucket (default: all)')
+    parse_suite.add_argument('--seed',
+                             default='',
+                             help='changes which puzzles are sampled (default: none)')
+    parse_suite.add_argument('-w', '--warmup',
+                             default=1,
+                             type=int,
+                             help='untimed runs per puzzle (default: 1)')
+    parse_suite.add_argument('-r', '--repeats',
+                             default=3,
+                             type=int,
+                             help='timed runs per puzzle, the median is kept (default: 3)')
+    parse_suite.add_argument('-t', '--timeout',
+                             default=None,
+                             type=float,
+                             help='timeout per run (in seconds) (default: none)')
+    parse_suite.add_argument('-o', '--out',
+                             default=None,
+                             help='the file to output results to')
+    add_solver_arguments(parse_suite)
+    add_filter_arguments(parse_suite)
+    parse_suite.set_defaults(func=suite)
+
+
+    # nonograms.py compare ...
+    parse_compare = subparsers.add_parser('compare',
+                                          help='flag puzzles that got slower between two results files')
+    parse_compare.add_argument('baseline',
+                               help='the results file to compare against')
+    parse_compare.add_argument('results',
+                               help='the new results file')
+    parse_compare.add_argument('--threshold',
+                               default=0.1,
+                               type=float,
+                               help='slowdown that counts as a regression, as a fraction (default: 0.1)')
+    parse_compare.add_argument('--min-time',
+                               default=0.005,
+                               type=float,
+                               help='ignore slowdowns smaller than this (in seconds) (default: 0.005)')
+    parse_compare.add_argument('--cpu-time',
+                               action='store_true',
+                               help='compare CPU time instead of wall time')
+    parse_compare.set_defaults(func=compare)
+
+
+    # nonograms.py serve ...
+    parse_serve = subparsers.add_parser('serve',
+                                        help='solve puzzles read as JSON lines from stdin')
+    parse_serve.add_argument('-t', '--timeout',
+                             default=None,
+                             type=float,
+                             help='timeout per puzzle (in seconds) (default: none)')
+    parse_serve.add_argument('-j', '--jobs',
+                             default=1,
+                             type=int,
+                             help='number of worker processes to solve puzzles with (default: 1)')
+    add_solver_arguments(parse_serve)
+    parse_serve.set_defaults(func=serve)
+
+
+    # nonograms.py linebench ...
+    parse_linebench = subparsers.add_parser('linebench',
+                                            help='measure line solver throughput')
+    parse_linebench.add_argument('-f', '--file',
+                                 default=NONOGRAMS_PATH,
+                                 help='the puzzle data file to sample lines from (default: %s)' % NONOGRAMS_PATH)
+    parse_linebench.add_argument('-n', '--samples',
+                                 default=10,
+                                 type=int,
+                                 help='partially solved states to sample per line, or with --adversarial, '
+                                      'tens of lines to generate of each kind (default: 10)')
+    parse_linebench.add_argument('-l', '--line-solver',
+                                 action='append',
+                                 dest='line_solvers',
+                                 choices=sorted(LINE_SOLVERS),
+                                 help='a line solving engine to compare, may be repeated (default: all)')
+    parse_linebench.add_argument('-a', '--adversarial',
+                                 action='store_true',
+                                 help='use generated lines that are hard to place runs in instead of '
+                                      'the puzzle data')
+    add_filter_arguments(parse_linebench)
+    parse_linebench.set_defaults(func=linebench)
+
+
+    # nonograms.py convert ...
+    parse_convert = subparsers.add_parser('convert',
+                                          help='convert puzzle data to another format')
+    parse_convert.add_argument('file',
+                               help='the puzzle data file to convert')
+    parse_convert.add_argument('out',
+                               help='the .bin, .json or .jsonl file to write')
+    parse_convert.add_argument('--no-grids',
+                               action='store_true',
+                               help='leave out the solution grids')
+    parse_convert.add_argument('--no-clues',
+                               action='store_true',
+                               help='leave out the row and column clues')
+    add_filter_arguments(parse_convert)
+    parse_convert.set_defaults(func=convert)
+
+
+    # nonograms.py compact ...
+    parse_compact = subparsers.add_parser('compact',
+                                          help='drop superseded puzzles from a .jsonl file')
+    parse_compact.add_argument('file',
+                               help='the .jsonl puzzle data file to compact')
+    parse_compact.set_defaults(func=compact)
+
+
+    # nonograms.py loadbench ...
+    parse_loadbench = subparsers.add_parser('loadbench',
+                                            help='compare load time and memory of puzzle data files')
+    parse_loadbench.add_argument('id',
+                                 type=int,
+                                 help='the puzzle ID to look up')
+    parse_loadbench.add_argument('files',
+                                 nargs='+',
+                                 help='the puzzle data files to compare')
+    parse_loadbench.set_defaults(func=loadbench)
+
+
     args = parser.parse_args()
     args.func(args)
@@ -0,0 +1,250 @@
+from collections import namedtuple
+
+import numpy as np
+
+from util import Budget, InconsistencyException
+from branch import fill_first
+from solve import progress_entry
+
+UNKNOWN = -1
+CROSSED = 0
+FILLED = 1
+
+Position = namedtuple('Position', ['x', 'y'])
+
+# Keeps the whole board in a single array and solves every dirty row at once,
+# then every dirty column, completely (like FullLineSolver). Branches on the
+# same cells as MinFreeBrancher, so it finds the same solutions as
+# NonogramProblem(line_solver=FullLineSolver).
+class ArrayNonogramProblem:
+    def __init__(self, grid, value_order=fill_first):
+        self.grid = grid
+        self.value_order = value_order
+        self.line_cache = None
+        grid.clear()
+        grid.set_controller(self)
+        self.board = np.full((grid.height, grid.width), UNKNOWN, dtype=np.int8)
+        self.rows = RunBatch(grid.rows)
+        self.columns = RunBatch(grid.columns)
+        self.dirty = [np.ones(grid.height, dtype=bool), np.ones(grid.width, dtype=bool)]
+        self.direction = 0
+        self.state_stack = [] # Used for backtracking
+        self.branching_attempts = 0
+        self.line_solves = 0
+        self.steps = 0
+
+    def next_constraint(self):
+        return None
+
+    # Each step solves a whole batch of lines, so the budget is checked after
+    # every one
+    def solve(self, abort_time=None, budget=None):
+        if budget is None:
+            budget = Budget(abort_time) if abort_time else None
+        try:
+            while self.advance():
+                if budget:
+                    budget.check(self)
+        finally:
+            self.update_grid()
+
+    def progress(self):
+        cells = self.grid.width * self.grid.height
+        determined = int((self.board != UNKNOWN).sum())
+        # The board from before the first guess is kept on the stack
+        settled = (int((self.state_stack[0]['board'] != UNKNOWN).sum())
+                   if self.state_stack else determined)
+        return progress_entry(self, cells, determined, settled)
+
+    # Keeps the grid up to date as well, for the GUI
+    def step(self, debug=False):
+        more = self.advance()
+        self.update_grid()
+        return more
+
+    def advance(self):
+        self.steps += 1
+        if not self.dirty[self.direction].any():
+            self.direction = 1 - self.direction
+        if self.dirty[self.direction].any():
+            try:
+                self.propagate(self.direction)
+            except InconsistencyException:
+                self.backtrack()
+            self.direction = 1 - self.direction
+        elif (self.board == UNKNOWN).any():
+            self.branch()
+        else:
+            return False
+        return True
+
+    def propagate(self, direction):
+        dirty = self.dirty[direction]
+        indices = np.flatnonzero(dirty)
+        if direction == 0:
+            lines = self.board[indices]
+            solved = solve_lines(lines, self.rows.subset(indices))
+            self.board[indices] = solved
+        else:
+            lines = self.board[:, indices].T
+            solved = solve_lines(lines, self.columns.subset(indices))
+            self.board[:, indices] = solved.T
+        self.line_solves += len(indices)
+        dirty[:] = False
+        self.dirty[1 - direction] |= (solved != lines).any(axis=0)
+
+    def branch(self):
+        unknown = self.board == UNKNOWN
+        free = unknown.sum(axis=1)[:, None] + unknown.sum(axis=0)[None, :]
+        free[~unknown] = self.grid.width + self.grid.height + 1
+        # argmin picks the first minimum in row-major order, the same tie
+        # break as MinFreeBrancher
+        y, x = np.unravel_index(np.argmin(free), free.shape)
+        value = self.value_order(self, Position(x, y))
+        self.branching_attempts += 1
+        self.state_stack.append({
+            'branch_cell': (x, y),
+            'value': value,
+            'board': self.board.copy(),
+        })
+        self.assign(x, y, value)
+
+    def backtrack(self):
+        if not self.state_stack:
+            raise InconsistencyException()
+        last_state = self.state_stack.pop()
+        self.board = last_state['board']
+        for dirty in self.dirty:
+            dirty[:] = False
+        x, y = last_state['branch_cell']
+        self.assign(x, y, not last_state['value'])
+
+    def assign(self, x, y, value):
+        self.board[y, x] = FILLED if value else CROSSED
+        self.dirty[0][y] = True
+        self.dirty[1][x] = True
+
+    def update_grid(self):
+        self.grid.grid = [[None if state == UNKNOWN else int(state) for state in row]
+                          for row in self.board.tolist()]
+
+
+# The clues of a set of lines, padded at the front with empty runs to the
+# same count so they can be solved together
+class RunBatch:
+    def __init__(self, clues, runs=None, padding=None):
+        if runs is None:
+            count = max(max(len(clue) for clue in clues), 1)
+            runs = np.array([[0] * (count - len(clue)) + list(clue) for clue in clues],
+                            dtype=np.intp).reshape(len(clues), count)
+            padding = np.array([count - len(clue) for clue in clues], dtype=np.intp)
+        self.runs = runs
+        self.padding = padding
+
+    def subset(self, indices):
+        return RunBatch(None, self.runs[indices], self.padding[indices])
+
+    def reversed(self):
+        runs = self.runs.copy()
+        for i, padding in enumerate(self.padding):
+            runs[i, padding:] = runs[i, padding:][::-1]
+        return RunBatch(None, runs, self.padding)
+
+
+# Returns the lines with every cell that is the same in all arrangements of
+# their runs filled in or crossed out
+def solve_lines(lines, batch):
+    length = lines.shape[1]
+    count = batch.runs.shape[1]
+    can_empty = lines != FILLED
+    crossed_before = np.zeros((len(lines), length + 1), dtype=np.intp)
+    np.cumsum(lines == CROSSED, axis=1, out=crossed_before[:, 1:])
+
+    prefixes = solve_prefixes(lines, batch)
+    suffixes = solve_prefixes(lines[:, ::-1], batch.reversed())
+    if not prefixes[:, count, length].all():
+        raise InconsistencyException()
+
+    lines_index = np.arange(len(lines))[:, None, None]
+    runs_index = np.arange(count)[None, :, None]
+    runs = batch.runs[:, :, None]
+    padding = batch.padding[:, None, None]
+    first = runs_index == padding
+    after = count - 1 - runs_index # Runs after this one
+
+    # Where each run can start in some valid arrangement
+    start = np.arange(length + 1)[None, None, :]
+    end = start + runs
+    fits = end <= length
+    end = np.minimum(end, length)
+    fits &= crossed_before[lines_index, end] == crossed_before[lines_index, start]
+    before = np.where(first, prefixes[lines_index, 0, start],
+                      (start > 0) &
+                      can_empty[lines_index, np.maximum(start - 1, 0)] &
+                      prefixes[lines_index, runs_index, np.maximum(start - 1, 0)])
+    # Padding runs index past the end, but they are never placed anyway
+    rest = suffixes[lines_index, np.minimum(padding + after, count),
+                    np.maximum(length - end - 1, 0)]
+    behind = np.where(after == 0, suffixes[lines_index, padding, length - end],
+                      (end < length) &
+                      can_empty[lines_index, np.minimum(end, length - 1)] &
+                      rest)
+    placed = fits & before & behind & (runs_index >= padding)
+
+    # Cells covered by a run in some arrangement
+    placed_before = np.zeros(placed.shape[:2] + (length + 2,), dtype=np.intp)
+    np.cumsum(placed, axis=2, out=placed_before[:, :, 1:])
+    cell = np.arange(length)[None, None, :]
+    can_fill = (placed_before[lines_index, runs_index, cell + 1] >
+                placed_before[lines_index, runs_index, np.maximum(cell + 1 - runs, 0)]).any(axis=1)
+
+    # Cells left empty between the first j runs and the rest in some arrangement
+    done_index = np.arange(count + 1)[None, :, None]
+    can_cross = (prefixes[:, :, :length] &
+                 suffixes[lines_index, np.minimum(padding + count - done_index, count),
+                          length - 1 - cell] &
+                 (done_index >= padding)).any(axis=1) & can_empty
+
+    solved = lines.copy()
+    solved[can_fill & ~can_cross] = FILLED
+    solved[can_cross & ~can_fill] = CROSSED
+    return solved
+
+def solve_prefixes(lines, batch):
+    # prefixes[b, j, i] is whether the first i cells of line b can hold
+    # exactly its first j runs, counting the padding
+    length = lines.shape[1]
+    count = batch.runs.shape[1]
+    can_empty = lines != FILLED
+    crossed_before = np.zeros((len(lines), length + 1), dtype=np.intp)
+    np.cumsum(lines == CROSSED, axis=1, out=crossed_before[:, 1:])
+    prefixes = np.zeros((len(lines), count + 1, length + 1), dtype=bool)
+    prefixes[:, 0, 0] = True
+    prefixes[:, 0, 1:] = np.cumsum(lines == FILLED, axis=1) == 0
+
+    lines_index = np.arange(len(lines))[:, None, None]
+    runs_index = np.arange(count)[None, :, None]
+    padding = batch.padding[:, None, None]
+    prefixes[:, 1:, 0] = runs_index[:, :, 0] < padding[:, :, 0]
+
+    # Work out up front where each run can end, and where the runs before it
+    # must have ended then, so each column only takes one lookup. Padding runs
+    # never end anywhere, which leaves their rows the same as the first.
+    end = np.arange(length + 1)[None, None, :]
+    start = end - batch.runs[:, :, None]
+    gap = start - 1
+    fits = ((start >= 0) & (runs_index >= padding) &
+            (crossed_before[lines_index, np.maximum(start, 0)] ==
+             crossed_before[lines_index, end]))
+    first = runs_index == padding
+    fits &= first | ((gap >= 0) & can_empty[lines_index, np.maximum(gap, 0)])
+    previous = np.maximum(np.where(first, start, gap), 0)
+    previous += (lines_index * (count + 1) + runs_index) * (length + 1)
+    fits = fits.transpose(2, 0, 1).copy()
+    previous = previous.transpose(2, 0, 1).copy()
+
+    flat_prefixes = prefixes.reshape(-1)
+    for i in xrange(1, length + 1):
+        prefixes[:, 1:, i] = ((prefixes[:, 1:, i - 1] & can_empty[:, i - 1, None]) |
+                              (flat_prefixes.take(previous[i]) & fits[i]))
+    return prefixes
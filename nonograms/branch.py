@@ -0,0 +1,87 @@
+from util import InconsistencyException
+
+def fill_first(problem, cell):
+    return True
+
+def cross_first(problem, cell):
+    return False
+
+# Guess whichever value is more common in the cell's row and column clues
+def density_first(problem, cell):
+    row = problem.grid.rows[cell.y]
+    column = problem.grid.columns[cell.x]
+    return (float(sum(row)) / problem.grid.width +
+            float(sum(column)) / problem.grid.height) >= 1
+
+
+class MinFreeBrancher:
+    def __init__(self, problem, value_order=fill_first):
+        self.problem = problem
+        self.value_order = value_order
+
+    def branch(self):
+        cell = self.candidates(1)[0]
+        self.problem.choose(cell, self.value_order(self.problem, cell))
+
+    # The blank cells with the fewest free cells in their row and column,
+    # ties broken by position
+    def candidates(self, count):
+        problem = self.problem
+        free_per_row = problem.free_per_row
+        free_per_col = problem.free_per_col
+        min_col = min(free for free in free_per_col if free)
+        best = []
+        for y, row in enumerate(problem.cells):
+            free_in_row = free_per_row[y]
+            if not free_in_row:
+                continue
+            if len(best) == count and free_in_row + min_col >= best[-1][0]:
+                continue
+            for cell in row:
+                if cell.state is None:
+                    key = free_in_row + free_per_col[cell.x]
+                    if len(best) < count or key < best[-1][0]:
+                        best.append((key, cell.y, cell.x, cell))
+                        best.sort()
+                        del best[count:]
+        return [cell for _, _, _, cell in best]
+
+
+# Tries both values of the most promising cells first. If one value leads
+# to a contradiction the other one is forced, otherwise we branch on the
+# cell where both values determine the most other cells.
+class ProbingBrancher(MinFreeBrancher):
+    def __init__(self, problem, value_order=fill_first, probe_limit=8):
+        MinFreeBrancher.__init__(self, problem, value_order)
+        self.probe_limit = probe_limit
+
+    def branch(self):
+        best = None
+        for cell in self.candidates(self.probe_limit):
+            filled = self.problem.probe(cell, True)
+            crossed = self.problem.probe(cell, False)
+            if filled is None and crossed is None:
+                raise InconsistencyException()
+            elif filled is None:
+                self.problem.force(cell, False)
+                return
+            elif crossed is None:
+                self.problem.force(cell, True)
+                return
+            score = min(filled, crossed)
+            if best is None or score > best[0]:
+                best = (score, cell)
+        cell = best[1]
+        self.problem.choose(cell, self.value_order(self.problem, cell))
+
+
+BRANCHERS = {
+    'minfree': MinFreeBrancher,
+    'probe': ProbingBrancher,
+}
+
+VALUE_ORDERS = {
+    'fill': fill_first,
+    'cross': cross_first,
+    'density': density_first,
+}
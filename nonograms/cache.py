@@ -0,0 +1,57 @@
+from collections import OrderedDict
+
+from util import InconsistencyException
+from line_solver import apply_masks, line_masks
+
+INCONSISTENT = object()
+
+class LineCache:
+    def __init__(self, size=100000):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def solve(self, line_solver, cells, direction, runs):
+        filled, crossed = line_masks(cells)
+        key = (line_solver, tuple(runs), len(cells), filled, crossed)
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            # Reinsert to mark the entry as the most recently used
+            self.entries[key] = entry
+            self.hits += 1
+            if entry is INCONSISTENT:
+                raise InconsistencyException()
+            fill, cross, placements = entry
+            apply_masks(cells, direction, fill & ~filled, cross & ~crossed)
+            return placements
+
+        self.misses += 1
+        try:
+            placements = line_solver(cells, direction).solve(runs)
+        except InconsistencyException:
+            self.store(key, INCONSISTENT)
+            raise
+        self.store(key, line_masks(cells) + (placements,))
+        return placements
+
+    def store(self, key, entry):
+        self.entries[key] = entry
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': self.size,
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+        }
@@ -1,35 +1,76 @@
 import json
+import mmap
 import os
 import random
+import struct
 from xml.etree import ElementTree
 
 from nonogram import Grid
 
 DATA_DIR = 'data'
 INDEX_PATH = os.path.join(DATA_DIR, 'index.json')
-NONOGRAMS_PATH = os.path.join(DATA_DIR, 'nonograms.json')
+NONOGRAMS_PATH = os.path.join(DATA_DIR, 'nonograms.jsonl')
 
 
+# Which puzzles to read: those with the longer side and the id in the given
+# ranges, inclusive, where either end of a range may be left open
+class GridFilter:
+    def __init__(self, min_size=None, max_size=None, min_nid=None, max_nid=None):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.min_nid = min_nid
+        self.max_nid = max_nid
+
+    def accepts_nid(self, nid):
+        return ((self.min_nid is None or int(nid) >= self.min_nid) and
+                (self.max_nid is None or int(nid) <= self.max_nid))
+
+    def accepts_size(self, width, height):
+        size = max(width, height)
+        return ((self.min_size is None or size >= self.min_size) and
+                (self.max_size is None or size <= self.max_size))
+
+
+# Iterating and len() only cover the puzzles accepted by grid_filter, which
+# each format checks before reading more of a puzzle than it has to
 class GridData:
+    grid_filter = None
+
     def get(self, nid, **kwargs):
         raise NotImplemented
 
     def __iter__(self):
         for nid in self._nonograms:
-            yield self.get(nid)
+            if self._accepts_nid(nid):
+                grid = self.get(nid)
+                if self._accepts_size(grid.width, grid.height):
+                    yield grid
 
     def __len__(self):
-        return len(self._nonograms)
+        if self.grid_filter is None:
+            return len(self._nonograms)
+        return sum(1 for _ in self)
+
+    def _accepts_nid(self, nid):
+        return self.grid_filter is None or self.grid_filter.accepts_nid(nid)
+
+    def _accepts_size(self, width, height):
+        return self.grid_filter is None or self.grid_filter.accepts_size(width, height)
 
     @staticmethod
-    def load(filename):
+    def load(filename, grid_filter=None):
         print('Loading nonograms data...')
         if filename.endswith('.json'):
             data = JsonGridData(filename)
+        elif filename.endswith('.jsonl'):
+            data = JsonLinesGridData(filename)
+        elif filename.endswith('.bin'):
+            data = BinaryGridData(filename)
         elif filename.endswith('.xml'):
             data = XmlGridData(filename)
         else:
             raise ValueError('Unspecified file format')
+        data.grid_filter = grid_filter
         print('Done')
         return data
 
@@ -46,8 +87,22 @@ class JsonGridData(GridData):
         with open(data_path, 'w') as f:
             json.dump(self._nonograms, f)
 
-    def store(self, nid, grid):
-        self._nonograms[nid] = grid.serialize()
+    def store(self, nid, grid, solution=True):
+        self._nonograms[nid] = grid.serialize(solution=solution)
+
+    def __contains__(self, nid):
+        return str(nid) in self._nonograms
+
+    def __iter__(self):
+        for nid, data in self._nonograms.iteritems():
+            if self._accepts_nid(nid) and self._accepts_size(data['width'], data['height']):
+                yield Grid.deserialize(data, nid=nid)
+
+    def __len__(self):
+        if self.grid_filter is None:
+            return len(self._nonograms)
+        return sum(1 for nid, data in self._nonograms.iteritems()
+                   if self._accepts_nid(nid) and self._accepts_size(data['width'], data['height']))
 
     def get(self, nid, **kwargs):
         data = self._nonograms[str(nid)]
@@ -56,6 +111,305 @@ class JsonGridData(GridData):
         raise KeyError
 
 
+# A corpus that only ever grows at the end: one serialized puzzle per line,
+# and a side index file with the id, offset, length, width and height of each
+# line, so storing a puzzle appends a line to each instead of rewriting
+# everything. Storing a puzzle again supersedes the old line; compact() drops
+# those. Puzzles are read from the file as they are needed, so neither loading
+# nor iterating keeps the corpus in memory, and filtered out puzzles aren't
+# read at all. Loading never changes the files, so a corpus can be read while
+# it's being written to: a stale index or a cut short last line is only
+# repaired once something is stored (or the file is compacted).
+class JsonLinesGridData(GridData):
+    def __init__(self, filename, create=False):
+        self.filename = filename
+        self._index_path = filename + '.idx'
+        self._entries = {}
+        self._records = 0
+        self._reader = None
+        self._writer = None
+        self._index_writer = None
+        if create and not os.path.exists(filename):
+            open(filename, 'wb').close()
+        elif not os.path.exists(filename):
+            raise IOError('No such puzzle data: %s' % filename)
+        self._load_index()
+
+    def _load_index(self):
+        self._entries = {}
+        entries = []
+        clean = False
+        if os.path.exists(self._index_path):
+            with open(self._index_path, 'rb') as f:
+                lines = f.read().split('\n')
+            # Anything after the last newline was cut short
+            clean = lines[-1] == ''
+            entries = [line.split() for line in lines[:-1]]
+            if all(len(entry) == 5 for entry in entries):
+                entries = [(nid, int(offset), int(length), int(width), int(height))
+                           for nid, offset, length, width, height in entries]
+            else:
+                entries = None
+        indexed_end = max([entry[1] + entry[2] for entry in entries or ()] or [0])
+        if entries is None or indexed_end > os.path.getsize(self.filename):
+            # The index doesn't belong to this file any more
+            entries = []
+            indexed_end = 0
+            clean = False
+
+        # Index the lines of puzzles whose store didn't get as far as the index,
+        # leaving out a last line that's cut short (or still being written)
+        # Where the last whole line ends
+        end = indexed_end
+        with open(self.filename, 'rb') as f:
+            f.seek(indexed_end)
+            for line in iter(f.readline, ''):
+                if not line.endswith('\n'):
+                    break
+                # A whole line was written in full, so this isn't a store that
+                # got cut short but a corrupt file
+                try:
+                    data = json.loads(line)
+                    entry = (str(data['id']), end, len(line), data['width'], data['height'])
+                except (ValueError, KeyError, TypeError) as e:
+                    raise ValueError('Corrupt puzzle data in %s at offset %d (%s: %s)' %
+                                     (self.filename, end, type(e).__name__, e))
+                entries.append(entry)
+                end += len(line)
+                clean = False
+
+        for nid, offset, _, width, height in entries:
+            self._entries[nid] = (offset, width, height)
+        self._records = len(entries)
+        self._index = entries
+        self._index_clean = clean
+        self._end = end
+
+    def _write_index(self, path, entries):
+        with open(path, 'wb') as f:
+            for entry in entries:
+                f.write('%s %d %d %d %d\n' % entry)
+
+    def __contains__(self, nid):
+        return str(nid) in self._entries
+
+    def __iter__(self):
+        # In file order, which is mostly a sequential read
+        for offset in sorted(self._offsets()):
+            yield self._read(offset)
+
+    def __len__(self):
+        return len(self._offsets())
+
+    def _offsets(self):
+        return [offset for nid, (offset, width, height) in self._entries.iteritems()
+                if self._accepts_nid(nid) and self._accepts_size(width, height)]
+
+    def get(self, nid, **kwargs):
+        return self._read(self._entries[str(nid)][0], **kwargs)
+
+    def _read(self, offset, **kwargs):
+        if self._reader is None:
+            self._reader = open(self.filename, 'rb')
+        self._reader.seek(offset)
+        data = json.loads(self._reader.readline())
+        return Grid.deserialize(data, nid=str(data['id']), **kwargs)
+
+    def store(self, nid, grid, solution=True):
+        if self._writer is None:
+            self._open_writer()
+        data = grid.serialize(solution=solution)
+        data['id'] = str(nid)
+        line = json.dumps(data, separators=(',', ':')) + '\n'
+        self._writer.seek(0, os.SEEK_END)
+        offset = self._writer.tell()
+        # The puzzle goes first: a line missing from the index is picked up
+        # again on loading, an index entry without its line is not
+        self._writer.write(line)
+        self._writer.flush()
+        self._index_writer.write('%s %d %d %d %d\n' % (data['id'], offset, len(line),
+                                                      grid.width, grid.height))
+        self._index_writer.flush()
+        self._entries[data['id']] = (offset, grid.width, grid.height)
+        self._records += 1
+
+    # Repairs what loading left alone before adding to the files
+    def _open_writer(self):
+        self._load_index()
+        if os.path.getsize(self.filename) > self._end:
+            with open(self.filename, 'r+b') as f:
+                f.truncate(self._end)
+        if not self._index_clean:
+            self._write_index(self._index_path, self._index)
+        self._writer = open(self.filename, 'ab')
+        self._index_writer = open(self._index_path, 'ab')
+
+    def superseded(self):
+        return self._records - len(self._entries)
+
+    # Rewrites the file with only the latest line of each puzzle
+    def compact(self):
+        self.close()
+        dropped = self.superseded()
+        temp_path = self.filename + '.tmp'
+        entries = []
+        with open(self.filename, 'rb') as source:
+            with open(temp_path, 'wb') as f:
+                for nid, (offset, width, height) in sorted(self._entries.iteritems(),
+                                                           key=lambda item: item[1][0]):
+                    source.seek(offset)
+                    line = source.readline()
+                    entries.append((nid, f.tell(), len(line), width, height))
+                    f.write(line)
+        self._write_index(temp_path + '.idx', entries)
+        # Without an index the file gets indexed from scratch on loading, so
+        # a crash in between can't pair the new file with the old index
+        if os.path.exists(self._index_path):
+            os.remove(self._index_path)
+        os.rename(temp_path, self.filename)
+        os.rename(temp_path + '.idx', self._index_path)
+        self._load_index()
+        return dropped
+
+    def close(self):
+        for f in (self._reader, self._writer, self._index_writer):
+            if f is not None:
+                f.close()
+        self._reader = None
+        self._writer = None
+        self._index_writer = None
+
+    @staticmethod
+    def write(filename, data, solution=True):
+        for path in (filename, filename + '.idx'):
+            if os.path.exists(path):
+                os.remove(path)
+        converted = JsonLinesGridData(filename, create=True)
+        for grid in data:
+            converted.store(grid.nid, grid, solution=solution)
+        converted.close()
+
+
+# Layout of a .bin corpus, all little-endian:
+#   header  magic, version, flags, puzzle count, index offset
+#   records width, height, then if FLAG_GRID the solution bit-packed row by
+#           row, then if FLAG_CLUES each row's and each column's clue as a
+#           count followed by the run lengths (one byte each)
+#   index   (nid, record offset) for every puzzle, sorted by nid
+class BinaryGridData(GridData):
+    MAGIC = 'NGRD'
+    VERSION = 1
+    FLAG_GRID = 1
+    FLAG_CLUES = 2
+    HEADER = struct.Struct('<4sHHIQ')
+    RECORD = struct.Struct('<HH')
+    INDEX_ENTRY = struct.Struct('<IQ')
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.flags, self._count, self._index_offset = \
+            self.HEADER.unpack_from(self._map, 0)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError('Not a version %s nonograms corpus: %s' % (self.VERSION, filename))
+
+    def __iter__(self):
+        for nid, offset in self._accepted():
+            yield self._read(offset, str(nid))
+
+    def __len__(self):
+        if self.grid_filter is None:
+            return self._count
+        return sum(1 for _ in self._accepted())
+
+    # Only reads the size of the puzzles with accepted ids
+    def _accepted(self):
+        for i in xrange(self._count):
+            nid, offset = self.INDEX_ENTRY.unpack_from(self._map,
+                                                       self._index_offset + i * self.INDEX_ENTRY.size)
+            if self._accepts_nid(nid) and self._accepts_size(*self.RECORD.unpack_from(self._map,
+                                                                                       offset)):
+                yield nid, offset
+
+    def get(self, nid, **kwargs):
+        return self._read(self._find(int(nid)), nid, **kwargs)
+
+    def _find(self, nid):
+        low = 0
+        high = self._count
+        while low < high:
+            middle = (low + high) // 2
+            entry_nid, offset = self.INDEX_ENTRY.unpack_from(
+                self._map, self._index_offset + middle * self.INDEX_ENTRY.size)
+            if entry_nid == nid:
+                return offset
+            elif entry_nid < nid:
+                low = middle + 1
+            else:
+                high = middle
+        raise KeyError(nid)
+
+    def _read(self, offset, nid, **kwargs):
+        width, height = self.RECORD.unpack_from(self._map, offset)
+        offset += self.RECORD.size
+        grid = None
+        rows = None
+        columns = None
+        if self.flags & self.FLAG_GRID:
+            size = (width * height + 7) // 8
+            packed = bytearray(self._map[offset:offset + size])
+            offset += size
+            grid = [[(packed[i >> 3] >> (i & 7)) & 1 for i in xrange(y * width, (y + 1) * width)]
+                    for y in xrange(height)]
+        if self.flags & self.FLAG_CLUES:
+            lines = []
+            for _ in xrange(height + width):
+                count = ord(self._map[offset])
+                lines.append(list(bytearray(self._map[offset + 1:offset + 1 + count])))
+                offset += 1 + count
+            rows = lines[:height]
+            columns = lines[height:]
+        return Grid(width, height, grid, rows=rows, columns=columns, nid=nid, **kwargs)
+
+    @staticmethod
+    def write(filename, data, grids=True, clues=True):
+        if not (grids or clues):
+            raise ValueError('Nothing to write without grids or clues')
+        flags = ((BinaryGridData.FLAG_GRID if grids else 0) |
+                 (BinaryGridData.FLAG_CLUES if clues else 0))
+        index = []
+        with open(filename, 'wb') as f:
+            f.write(BinaryGridData.HEADER.pack(BinaryGridData.MAGIC, BinaryGridData.VERSION,
+                                               flags, 0, 0))
+            for grid in data:
+                if grid.width > 255 or grid.height > 255:
+                    raise ValueError('Puzzle %s is too large to pack' % grid.nid)
+                index.append((int(grid.nid), f.tell()))
+                record = bytearray(BinaryGridData.RECORD.pack(grid.width, grid.height))
+                if grids:
+                    # The flag is for the whole file, so every puzzle needs one
+                    if grid.solution is None:
+                        raise ValueError('Puzzle %s has no solution to pack (write it without '
+                                         'grids)' % grid.nid)
+                    packed = bytearray((grid.width * grid.height + 7) // 8)
+                    for i, cell in enumerate(cell for row in grid.solution for cell in row):
+                        if cell:
+                            packed[i >> 3] |= 1 << (i & 7)
+                    record += packed
+                if clues:
+                    for line in grid.rows + grid.columns:
+                        record.append(len(line))
+                        record += bytearray(line)
+                f.write(record)
+            index.sort()
+            index_offset = f.tell()
+            for entry in index:
+                f.write(BinaryGridData.INDEX_ENTRY.pack(*entry))
+            f.seek(0)
+            f.write(BinaryGridData.HEADER.pack(BinaryGridData.MAGIC, BinaryGridData.VERSION,
+                                               flags, len(index), index_offset))
+
+
 class XmlGridData(GridData):
     CHAR_MAP = { 'X': 1, '.': 0 }
     def __init__(self, filename):
@@ -2,7 +2,7 @@ from util import InconsistencyException
 
 # TODO
 # - Some cells can be filled even if they don't belong to the leftmost and
-#   rightmost placements of a single run
+#   rightmost placements of a single run (FullLineSolver finds these)
 # 3 3 1   ----- | -##-#----
 # 5 1 1 2 ##### | --#------
 # - Mark each run with the spans it may belong to
@@ -13,14 +13,17 @@ class LineSolver:
         self.direction = direction
         self.spans = CellSpan.split(cells)
 
+    # Returns the leftmost and rightmost placements the deductions came from
     def solve(self, runs):
         if not runs:
             for cell in self.cells:
                 cell.cross(self.direction)
-            return
+            return [], []
 
         left_sol = self.solve_left(runs)
         right_sol = self.solve_right(runs)
+        if left_sol is None or right_sol is None:
+            raise InconsistencyException()
         for run, left, right in zip(runs, left_sol, right_sol):
             for i in xrange(right, left + run):
                 self.cells[i].fill(self.direction)
@@ -33,109 +36,175 @@ class LineSolver:
             self.cells[i].cross(self.direction)
         for i in xrange(right_sol[-1] + runs[-1], len(self.cells)):
             self.cells[i].cross(self.direction)
+        return left_sol, right_sol
 
-    def solve_left(self, runs, run_index=0, span_start=0, in_span_start=0, seek_filled=False):
-        if span_start >= len(self.spans):
-            if run_index >= len(runs):
-                return []
-            else:
-                raise InconsistencyException()
-        span = self.spans[span_start]
-
-        if run_index >= len(runs):
-            for i in xrange(in_span_start, len(span)):
-                if span[i]:
-                    raise InconsistencyException()
-            return self.solve_left(runs, run_index, span_start + 1)
-
-        run = runs[run_index]
-
-        if in_span_start >= len(span):
-            return self.solve_left(runs, run_index, span_start + 1)
-
-        if seek_filled:
-            for i in xrange(in_span_start, min(len(span), in_span_start + run)):
-                if span[i]:
+    # Both searches go through the placements of each run in turn, left to
+    # right (or right to left), and come back to the latest run that can
+    # move on when the rest don't fit. They return the start of each run, or
+    # None if the runs can't be placed at all.
+    # Where the search goes from a run, span and starting point doesn't depend
+    # on the runs before, so once that has failed it isn't tried again.
+    # Without this, lines that can't be solved take exponential time.
+    def solve_left(self, runs):
+        spans = self.spans
+        positions = [0] * len(runs)
+        # Where to pick up the search for each placed run: its span, where it
+        # started looking in the span, where it was placed, and the length of
+        # searched at the time. Everything searched since then has failed once
+        # the search comes back to it.
+        choices = []
+        searched = []
+        failed = set()
+        run_index = 0
+        span_index = 0
+        start = 0
+        seek_filled = False
+        resume = None
+        while True:
+            placed = None
+            if span_index >= len(spans):
+                if run_index >= len(runs):
+                    return positions
+            elif run_index >= len(runs):
+                # No runs left, so the rest of the line must be empty
+                filled = spans[span_index].filled
+                if True not in filled[start:]:
+                    span_index += 1
+                    start = 0
                     seek_filled = False
-                    break
-
-        for i in xrange(in_span_start, len(span) - run + 1):
-            if i > 0 and span[i-1]:
-                raise InconsistencyException()
-            if seek_filled and span[i + run - 1]:
+                    continue
+            elif start >= len(spans[span_index]):
+                span_index += 1
+                start = 0
                 seek_filled = False
-            if (not seek_filled) and (i + run == len(span) or not span[i+run]):
-                try:
-                    solution = self.solve_left(runs, run_index + 1, span_start, i + run + 1)
-                    solution.insert(0, span.start_index + i)
-                    return solution
-                except InconsistencyException:
-                    # If this fails, this run must include the next filled square!
-                    seek_filled = True
-
-        for i in xrange(max(in_span_start, len(span) - run), len(span)):
-            if span[i]:
-                raise InconsistencyException()
+                continue
+            elif (run_index, span_index, start, seek_filled) not in failed or resume is not None:
+                span = spans[span_index]
+                filled = span.filled
+                length = len(filled)
+                run = runs[run_index]
+                if resume is None:
+                    searched.append((run_index, span_index, start, seek_filled))
+                    i = start
+                    # The run must cover the next filled cell if the later
+                    # runs can't
+                    if seek_filled and True in filled[start:start + run]:
+                        seek_filled = False
+                else:
+                    i = resume
+                    resume = None
+                while i <= length - run:
+                    if i > 0 and filled[i - 1]:
+                        break
+                    if seek_filled and filled[i + run - 1]:
+                        seek_filled = False
+                    if not seek_filled and (i + run == length or not filled[i + run]):
+                        placed = i
+                        break
+                    i += 1
+                else:
+                    if True not in filled[max(start, length - run):]:
+                        # The run doesn't fit in this span, try the next one
+                        span_index += 1
+                        start = 0
+                        continue
+                if placed is not None:
+                    positions[run_index] = span.start_index + placed
+                    choices.append((run_index, span_index, start, placed, len(searched)))
+                    run_index += 1
+                    start = placed + run + 1
+                    seek_filled = False
+                    continue
 
-        return self.solve_left(runs, run_index, span_start + 1, seek_filled=seek_filled)
+            # The runs so far can't be completed, so move the latest one on.
+            # Now it has to cover the next filled cell.
+            if not choices:
+                return None
+            run_index, span_index, start, placed, searched_count = choices.pop()
+            failed.update(searched[searched_count:])
+            del searched[searched_count:]
+            resume = placed + 1
+            seek_filled = True
 
-    def solve_right(self, runs, run_index=None, span_start=None, in_span_end=None, seek_filled=False):
-        if span_start is None:
-            span_start = len(self.spans) - 1
-        if span_start < 0:
-            if run_index < 0:
-                return []
+    def solve_right(self, runs):
+        spans = self.spans
+        positions = [0] * len(runs)
+        choices = []
+        searched = []
+        failed = set()
+        run_index = len(runs) - 1
+        span_index = len(spans) - 1
+        end = None
+        seek_filled = False
+        resume = None
+        while True:
+            placed = None
+            if span_index < 0:
+                if run_index < 0:
+                    return positions
             else:
-                raise InconsistencyException()
-        span = self.spans[span_start]
-
-        if in_span_end is None:
-            in_span_end = len(span) - 1
-
-        if run_index is None:
-            run_index = len(runs) - 1
-        if run_index < 0:
-            for i in xrange(0, in_span_end + 1):
-                if span[i]:
-                    raise InconsistencyException()
-            return self.solve_right(runs, run_index, span_start - 1)
-
-        run = runs[run_index]
-
-        if in_span_end < 0:
-            return self.solve_right(runs, run_index, span_start - 1)
-        in_span_start = in_span_end - run + 1
-
-        if seek_filled:
-            for i in xrange(max(0, in_span_start), in_span_start + run):
-                if span[i]:
+                span = spans[span_index]
+                filled = span.filled
+                length = len(filled)
+                if end is None:
+                    end = length - 1
+                if run_index < 0:
+                    if True not in filled[:max(end + 1, 0)]:
+                        span_index -= 1
+                        end = None
+                        seek_filled = False
+                        continue
+                elif end < 0:
+                    span_index -= 1
+                    end = None
                     seek_filled = False
-                    break
+                    continue
+                elif (run_index, span_index, end, seek_filled) not in failed or resume is not None:
+                    run = runs[run_index]
+                    if resume is None:
+                        searched.append((run_index, span_index, end, seek_filled))
+                        i = end - run + 1
+                        if seek_filled and True in filled[max(0, i):end + 1]:
+                            seek_filled = False
+                    else:
+                        i = resume
+                        resume = None
+                    while i >= 0:
+                        if i + run < length and filled[i + run]:
+                            break
+                        if seek_filled and filled[i]:
+                            seek_filled = False
+                        if not seek_filled and (i == 0 or not filled[i - 1]):
+                            placed = i
+                            break
+                        i -= 1
+                    else:
+                        if True not in filled[:min(end + 1, run)]:
+                            span_index -= 1
+                            end = None
+                            continue
+                    if placed is not None:
+                        positions[run_index] = span.start_index + placed
+                        choices.append((run_index, span_index, end, placed, len(searched)))
+                        run_index -= 1
+                        end = placed - 2
+                        seek_filled = False
+                        continue
 
-        for i in xrange(in_span_start, -1, -1):
-            if i + run < len(span) and span[i+run]:
-                raise InconsistencyException()
-            if seek_filled and span[i]:
-                seek_filled = False
-            if (not seek_filled) and (i == 0 or not span[i-1]):
-                try:
-                    solution = self.solve_right(runs, run_index - 1, span_start, i - 2)
-                    solution.append(span.start_index + i)
-                    return solution
-                except InconsistencyException:
-                    seek_filled = True
-
-        for i in xrange(0, min(in_span_end + 1, run)):
-            if span[i]:
-                raise InconsistencyException()
-
-        return self.solve_right(runs, run_index, span_start - 1, seek_filled=seek_filled)
+            if not choices:
+                return None
+            run_index, span_index, end, placed, searched_count = choices.pop()
+            failed.update(searched[searched_count:])
+            del searched[searched_count:]
+            resume = placed - 1
+            seek_filled = True
 
 
 class CellSpan:
     def __init__(self, cells, start_index):
         self.cells = cells
         self.start_index = start_index
+        self.filled = [cell.state == True for cell in cells]
         # self.runs = None
 
     # def runs(self):
@@ -172,3 +241,215 @@ class CellSpan:
         if i < len(cells):
             spans.append(CellSpan(cells[i:], i))
         return spans
+
+
+class BitmaskLineSolver:
+    def __init__(self, cells, direction):
+        self.cells = cells
+        self.direction = direction
+        self.length = len(cells)
+        self.filled, self.crossed = line_masks(cells)
+
+    def solve(self, runs):
+        length = self.length
+        if not runs:
+            if self.filled:
+                raise InconsistencyException()
+            apply_masks(self.cells, self.direction, 0, ((1 << length) - 1) & ~self.crossed)
+            return [], []
+
+        left_sol = self.solve_left(runs, self.filled, self.crossed)
+        right_sol = [length - start - run for start, run in
+                     zip(reversed(self.solve_left(runs[::-1],
+                                                  reverse_mask(self.filled, length),
+                                                  reverse_mask(self.crossed, length))),
+                         runs)]
+
+        fill = 0
+        cross = (1 << length) - 1
+        for run, left, right in zip(runs, left_sol, right_sol):
+            if right < left + run:
+                fill |= ((1 << (left + run - right)) - 1) << right
+            cross &= ~(((1 << (right + run - left)) - 1) << left)
+        apply_masks(self.cells, self.direction, fill & ~self.filled, cross & ~self.crossed)
+        return left_sol, right_sol
+
+    def solve_left(self, runs, filled, crossed):
+        length = self.length
+        failed = set()
+
+        # Returns the leftmost starts of runs[run_index:] in reverse order, or
+        # None if they can't be placed at or after start
+        def place(run_index, start):
+            if run_index == len(runs):
+                return [] if not filled >> start else None
+            if (run_index, start) in failed:
+                return None
+            run = runs[run_index]
+            mask = (1 << run) - 1
+            limit = length - run
+            rest = filled >> start
+            if rest:
+                # The run can't skip past the next filled cell
+                limit = min(limit, start + (rest & -rest).bit_length() - 1)
+            i = start
+            while i <= limit:
+                blocked = (crossed >> i) & mask
+                if blocked:
+                    i += blocked.bit_length()
+                    continue
+                if not (filled >> (i + run)) & 1:
+                    solution = place(run_index + 1, i + run + 1)
+                    if solution is not None:
+                        solution.append(i)
+                        return solution
+                i += 1
+            failed.add((run_index, start))
+            return None
+
+        solution = place(0, 0)
+        if solution is None:
+            raise InconsistencyException()
+        solution.reverse()
+        return solution
+
+
+# Doesn't go through placements, so solve() returns None
+class FullLineSolver:
+    def __init__(self, cells, direction):
+        self.cells = cells
+        self.direction = direction
+        self.states = [cell.state for cell in cells]
+
+    def solve(self, runs):
+        states = self.states
+        length = len(states)
+        can_empty = [state != True for state in states]
+        crossed_before = [0]
+        for state in states:
+            crossed_before.append(crossed_before[-1] + (state == False))
+
+        prefixes = self.solve_prefixes(runs, can_empty, crossed_before)
+        suffixes = self.solve_suffixes(runs, can_empty, crossed_before)
+        if not prefixes[len(runs)][length]:
+            raise InconsistencyException()
+
+        # Mark every cell that is covered by some run in a valid arrangement
+        coverage = [0] * (length + 1)
+        for j, run in enumerate(runs):
+            before = prefixes[j]
+            after = suffixes[j + 1]
+            for start in xrange(length - run + 1):
+                end = start + run
+                if crossed_before[end] != crossed_before[start]:
+                    continue
+                if start > 0 and not (can_empty[start - 1] and before[start - 1]):
+                    continue
+                if start == 0 and not before[0]:
+                    continue
+                if end < length and not (can_empty[end] and after[end + 1]):
+                    continue
+                if end == length and not after[length]:
+                    continue
+                coverage[start] += 1
+                coverage[end] -= 1
+
+        covered = 0
+        for i, state in enumerate(states):
+            covered += coverage[i]
+            if state is not None:
+                continue
+            if not covered:
+                self.cells[i].cross(self.direction)
+            elif not any(prefix[i] and suffix[i + 1]
+                         for prefix, suffix in zip(prefixes, suffixes)):
+                self.cells[i].fill(self.direction)
+
+    def solve_prefixes(self, runs, can_empty, crossed_before):
+        # prefixes[j][i] is whether the first i cells can hold exactly the
+        # first j runs
+        length = len(can_empty)
+        prefixes = [[False] * (length + 1) for _ in xrange(len(runs) + 1)]
+        row = prefixes[0]
+        row[0] = True
+        for i in xrange(1, length + 1):
+            row[i] = row[i - 1] and can_empty[i - 1]
+        for j, run in enumerate(runs):
+            previous = row
+            row = prefixes[j + 1]
+            for i in xrange(run, length + 1):
+                if row[i - 1] and can_empty[i - 1]:
+                    row[i] = True
+                    continue
+                start = i - run
+                if crossed_before[i] == crossed_before[start]:
+                    if start == 0:
+                        row[i] = previous[0]
+                    else:
+                        row[i] = can_empty[start - 1] and previous[start - 1]
+        return prefixes
+
+    def solve_suffixes(self, runs, can_empty, crossed_before):
+        # suffixes[j][i] is whether the cells from i onwards can hold exactly
+        # the runs from j onwards
+        length = len(can_empty)
+        count = len(runs)
+        suffixes = [[False] * (length + 2) for _ in xrange(count + 1)]
+        row = suffixes[count]
+        row[length] = True
+        for i in xrange(length - 1, -1, -1):
+            row[i] = row[i + 1] and can_empty[i]
+        for j in xrange(count - 1, -1, -1):
+            run = runs[j]
+            following = row
+            row = suffixes[j]
+            for i in xrange(length - run, -1, -1):
+                if row[i + 1] and can_empty[i]:
+                    row[i] = True
+                    continue
+                end = i + run
+                if crossed_before[end] == crossed_before[i]:
+                    if end == length:
+                        row[i] = following[length]
+                    else:
+                        row[i] = can_empty[end] and following[end + 1]
+        return suffixes
+
+
+def line_masks(cells):
+    filled = 0
+    crossed = 0
+    bit = 1
+    for cell in cells:
+        if cell.state:
+            filled |= bit
+        elif cell.state == False:
+            crossed |= bit
+        bit <<= 1
+    return filled, crossed
+
+def apply_masks(cells, direction, fill, cross):
+    while fill:
+        bit = fill & -fill
+        cells[bit.bit_length() - 1].fill(direction)
+        fill ^= bit
+    while cross:
+        bit = cross & -cross
+        cells[bit.bit_length() - 1].cross(direction)
+        cross ^= bit
+
+def placement_mask(runs, starts):
+    mask = 0
+    for run, start in zip(runs, starts):
+        mask |= ((1 << run) - 1) << start
+    return mask
+
+def reverse_mask(mask, length):
+    return int(bin(mask)[:1:-1].ljust(length, '0'), 2) if mask else 0
+
+
+LINE_SOLVERS = {
+    'span': LineSolver,
+    'bitmask': BitmaskLineSolver,
+    'full': FullLineSolver,
+}
@@ -3,20 +3,28 @@ class Grid:
         self.nid = nid
         self.width = width
         self.height = height
-        self.grid = grid or [[0] * width for _ in xrange(height)]
-        self.rows = rows or [self._project_line(self.grid[y])
-                             for y in xrange(height)]
-        self.columns = columns or [self._project_line([row[x] for row in self.grid])
-                                   for x in xrange(width)]
+        if grid is None and (rows is None or columns is None):
+            grid = [[0] * width for _ in xrange(height)]
+        # The solution is optional when the clues are given, and is only kept
+        # around for display and verification
+        self.solution = grid
+        self.grid = grid or [[None] * width for _ in xrange(height)]
+        self.rows = rows if rows is not None else [self._project_line(grid[y])
+                                                   for y in xrange(height)]
+        self.columns = columns if columns is not None else [self._project_line([row[x] for row in grid])
+                                                            for x in xrange(width)]
         self.controller = None
 
     def set_controller(self, controller):
         self.controller = controller
 
     def clear(self):
-        for y in xrange(self.height):
-            for x in xrange(self.width):
-                self[x,y] = None
+        self.grid = [[None] * self.width for _ in xrange(self.height)]
+
+    def verify(self):
+        return ([self._project_line(row) for row in self.grid] == self.rows and
+                [self._project_line([row[x] for row in self.grid])
+                 for x in xrange(self.width)] == self.columns)
 
     def _project_line(self, line):
         lengths = []
@@ -31,20 +39,26 @@ class Grid:
             lengths.append(cell_count)
         return lengths
 
-    def serialize(self):
-        return {
+    def serialize(self, solution=True):
+        data = {
             'id': self.nid,
             'width': self.width,
             'height': self.height,
-            'grid': self.grid,
+            'rows': self.rows,
+            'columns': self.columns,
         }
+        if solution and self.solution is not None:
+            data['grid'] = self.solution
+        return data
 
     @staticmethod
     def deserialize(data, **kwargs):
         return Grid(
             data['width'],
             data['height'],
-            data['grid'],
+            data.get('grid'),
+            rows=data.get('rows'),
+            columns=data.get('columns'),
             **kwargs
         )
 
@@ -0,0 +1,136 @@
+import multiprocessing
+import select
+import signal
+import time
+import traceback
+
+class WorkerError(RuntimeError):
+    pass
+
+# Each worker gets one task at a time over its own pipe, so a worker that
+# runs past the timeout can be killed and replaced without disturbing the
+# others. Tasks are only pulled from the input as workers become idle.
+class WorkerPool:
+    def __init__(self, function, jobs, timeout=None, initializer=None):
+        self.function = function
+        self.jobs = jobs
+        self.timeout = timeout
+        self.initializer = initializer
+        self.workers = []
+
+    # Yields (key, result) for each (key, args) task as it completes, with a
+    # result of None if the worker had to be killed
+    def imap_unordered(self, tasks):
+        tasks = iter(tasks)
+        exhausted = False
+        try:
+            while len(self.workers) < self.jobs:
+                self.workers.append(Worker(self.function, self.initializer))
+            while True:
+                for worker in self.workers:
+                    if worker.key is None and not exhausted:
+                        try:
+                            key, args = next(tasks)
+                        except StopIteration:
+                            exhausted = True
+                            break
+                        worker.assign(key, args)
+                busy = [worker for worker in self.workers if worker.key is not None]
+                if not busy:
+                    break
+
+                ready, _, _ = select.select([worker.conn for worker in busy], [], [],
+                                            self._poll_interval(busy))
+                for worker in busy:
+                    key = worker.key
+                    if worker.conn in ready:
+                        try:
+                            result = worker.receive()
+                        except EOFError:
+                            # The worker died on its own
+                            self._replace(worker)
+                            yield key, None
+                            continue
+                        if isinstance(result, WorkerError):
+                            raise result
+                        yield key, result
+                    elif self.timeout and time.time() - worker.started > self.timeout:
+                        self._replace(worker)
+                        yield key, None
+        finally:
+            self.close()
+
+    def _poll_interval(self, busy):
+        if not self.timeout:
+            return None
+        now = time.time()
+        return max(0, min(worker.started + self.timeout - now for worker in busy))
+
+    def _replace(self, worker):
+        worker.kill()
+        self.workers[self.workers.index(worker)] = Worker(self.function, self.initializer)
+
+    def close(self):
+        for worker in self.workers:
+            worker.stop()
+        self.workers = []
+
+
+class Worker:
+    def __init__(self, function, initializer=None):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=work,
+                                               args=(function, child_conn, initializer))
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+        self.key = None
+        self.started = None
+
+    def assign(self, key, args):
+        self.key = key
+        self.started = time.time()
+        self.conn.send(args)
+
+    def receive(self):
+        result = self.conn.recv()
+        self.key = None
+        return result
+
+    def kill(self):
+        self.process.terminate()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self):
+        if self.key is not None:
+            self.kill()
+            return
+        try:
+            self.conn.send(None)
+        except IOError:
+            pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.conn.close()
+
+
+def work(function, conn, initializer=None):
+    # Let the parent decide what to do about Ctrl-C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if initializer:
+        initializer()
+    while True:
+        try:
+            args = conn.recv()
+        except EOFError:
+            break
+        if args is None:
+            break
+        try:
+            result = function(*args)
+        except Exception:
+            result = WorkerError(traceback.format_exc())
+        conn.send(result)
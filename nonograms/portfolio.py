@@ -0,0 +1,100 @@
+import select
+import time
+
+from nonogram import Grid
+from parallel import Worker, WorkerError
+from solve import create_problem, count_solutions
+from line_solver import FullLineSolver
+from schedule import ChangesQueue
+from branch import ProbingBrancher, cross_first, density_first
+
+# Configurations that do well on different kinds of puzzles: cheap
+# propagation with minfree guesses for the ones that hardly branch, probing
+# for the ones that branch a lot, and learning and other value orders for
+# the ones where the first guesses tend to be wrong
+PORTFOLIO = [
+    ('span-minfree', {}),
+    ('full-probe', { 'line_solver': FullLineSolver, 'brancher': ProbingBrancher }),
+    ('span-learning', { 'learning': True, 'value_order': density_first }),
+    ('full-cross', { 'line_solver': FullLineSolver, 'queue': ChangesQueue,
+                     'value_order': cross_first }),
+]
+
+# Races several solver configurations on each puzzle, one process each, and
+# takes the first to finish. The others are killed and started over for the
+# next puzzle. Running out of time doesn't count as finishing, but finding
+# that there is no solution does.
+class Portfolio:
+    def __init__(self, configurations=PORTFOLIO, timeout=None, count=None, kill_timeout=None):
+        self.configurations = configurations
+        self.timeout = timeout
+        self.count = count
+        # Workers enforce the timeout themselves, this only catches runaways
+        self.kill_timeout = kill_timeout
+        self.workers = [Worker(solve_configuration) for _ in configurations]
+
+    # Returns the name of the winning configuration and its outcome, or None
+    # and the outcome of one that timed out (None if killed) if none won
+    def solve(self, grid):
+        data = grid.serialize(solution=False)
+        for worker, (name, options) in zip(self.workers, self.configurations):
+            worker.assign(name, (data, grid.nid, options, self.timeout, self.count))
+        deadline = time.time() + self.kill_timeout if self.kill_timeout else None
+        busy = list(self.workers)
+        outcome = None
+        try:
+            while busy:
+                wait = max(0, deadline - time.time()) if deadline else None
+                ready, _, _ = select.select([worker.conn for worker in busy], [], [], wait)
+                if not ready:
+                    return None, outcome
+                for worker in [worker for worker in busy if worker.conn in ready]:
+                    name = worker.key
+                    busy.remove(worker)
+                    try:
+                        result = worker.receive()
+                    except EOFError:
+                        # The worker died on its own
+                        self._replace(worker)
+                        continue
+                    if isinstance(result, WorkerError):
+                        raise result
+                    if result.get('error') != 'TimeoutException':
+                        return name, result
+                    outcome = result
+            return None, outcome
+        finally:
+            for worker in busy:
+                self._replace(worker)
+
+    def _replace(self, worker):
+        worker.kill()
+        self.workers[self.workers.index(worker)] = Worker(solve_configuration)
+
+    def close(self):
+        for worker in self.workers:
+            worker.stop()
+        self.workers = []
+
+
+def solve_configuration(data, nid, options, timeout, count):
+    grid = Grid.deserialize(data, nid=nid)
+    problem = create_problem(grid, **options)
+    start_time = time.clock()
+    start_wall_time = time.time()
+    abort_time = start_time + timeout if timeout else None
+    outcome = {}
+    try:
+        if count is not None:
+            outcome['solutions'] = count_solutions(problem, limit=count, abort_time=abort_time)
+        else:
+            problem.solve(abort_time=abort_time)
+        outcome['grid'] = grid.grid
+    except RuntimeError as e:
+        outcome['error'] = type(e).__name__
+    outcome['time'] = time.clock() - start_time
+    outcome['wall_time'] = time.time() - start_wall_time
+    outcome['branching_attempts'] = problem.branching_attempts
+    outcome['line_solves'] = problem.line_solves
+    outcome['steps'] = problem.steps
+    return outcome
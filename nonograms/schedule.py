@@ -0,0 +1,98 @@
+import heapq
+import itertools
+from collections import deque
+
+class FifoQueue:
+    def __init__(self, constraints=()):
+        self.queue = deque(constraints)
+
+    def push(self, constraint):
+        self.queue.append(constraint)
+
+    def update(self, constraint):
+        pass
+
+    def pop(self):
+        return self.queue.popleft()
+
+    def peek(self):
+        return self.queue[0] if self.queue else None
+
+    def __len__(self):
+        return len(self.queue)
+
+
+class PriorityQueue:
+    def __init__(self, constraints=()):
+        self.heap = []
+        self.counter = itertools.count()
+        for constraint in constraints:
+            self.push(constraint)
+
+    def priority(self, constraint):
+        raise NotImplementedError
+
+    def push(self, constraint):
+        # The counter keeps equal priorities in FIFO order
+        heapq.heappush(self.heap, (self.priority(constraint), next(self.counter), constraint))
+
+    def update(self, constraint):
+        pass
+
+    def pop(self):
+        return heapq.heappop(self.heap)[2]
+
+    def peek(self):
+        return self.heap[0][2] if self.heap else None
+
+    def __len__(self):
+        return len(self.heap)
+
+
+# Lines with the least room to move their runs around first
+class SlackQueue(PriorityQueue):
+    def priority(self, constraint):
+        return constraint.slack
+
+
+# Lines with the most cells changed since they were last solved first
+class ChangesQueue(PriorityQueue):
+    def __init__(self, constraints=()):
+        self.entries = {}
+        PriorityQueue.__init__(self, constraints)
+
+    def priority(self, constraint):
+        return -len(constraint.changed)
+
+    def push(self, constraint):
+        entry = [self.priority(constraint), next(self.counter), constraint]
+        self.entries[constraint] = entry
+        heapq.heappush(self.heap, entry)
+
+    def update(self, constraint):
+        # Leave the old entry in the heap, it's skipped once it comes up
+        entry = self.entries[constraint]
+        entry[2] = None
+        self.push(constraint)
+
+    def pop(self):
+        while True:
+            constraint = heapq.heappop(self.heap)[2]
+            if constraint is not None:
+                del self.entries[constraint]
+                return constraint
+
+    def peek(self):
+        while self.heap and self.heap[0][2] is None:
+            heapq.heappop(self.heap)
+        return self.heap[0][2] if self.heap else None
+
+    def __len__(self):
+        return len(self.entries)
+
+
+QUEUES = {
+    'fifo': FifoQueue,
+    'slack': SlackQueue,
+    'changes': ChangesQueue,
+}
@@ -1,17 +1,64 @@
-import time
 import traceback
+from collections import deque
 
 from nonogram import Grid
-from util import Direction, InconsistencyException, TimeoutException
-from line_solver import LineSolver
+from util import Direction, Budget, InconsistencyException
+from line_solver import LineSolver, placement_mask
+from schedule import FifoQueue
+from branch import MinFreeBrancher, fill_first
+
+# The numpy backend always solves lines completely and branches like
+# MinFreeBrancher, so the value order is the only option it takes
+def create_problem(grid, backend='objects', **options):
+    if backend == 'numpy':
+        from array_solve import ArrayNonogramProblem
+        return ArrayNonogramProblem(grid, value_order=options.get('value_order', fill_first))
+    return NonogramProblem(grid, **options)
+
+# Keeps searching past the first solution, up to the limit if there is one.
+# The grid ends up holding the first solution found.
+def count_solutions(problem, limit=None, abort_time=None, budget=None):
+    if getattr(problem, 'learning', False):
+        # Backjumping can undo choices that were flipped after searching their
+        # first value, which would count the solutions found there again
+        problem.learning = False
+    count = 0
+    first = None
+    try:
+        while not limit or count < limit:
+            try:
+                problem.solve(abort_time, budget)
+            except InconsistencyException:
+                break
+            count += 1
+            if first is None:
+                first = [row[:] for row in problem.grid.grid]
+            try:
+                problem.backtrack()
+            except InconsistencyException:
+                break
+    finally:
+        if first is not None:
+            problem.grid.grid = first
+    return count
 
 class NonogramProblem:
-    def __init__(self, grid):
+    # Steps are cheap, so budgets are only checked every so often
+    check_interval = 64
+
+    def __init__(self, grid, line_solver=LineSolver, line_cache=None, incremental=True,
+                 queue=FifoQueue, brancher=MinFreeBrancher, value_order=fill_first,
+                 learning=False, nogood_limit=1000):
         self.grid = grid
+        self.line_solver = line_solver
+        self.line_cache = line_cache
+        self.incremental = incremental
+        self.learning = learning
+        grid.clear()
         grid.set_controller(self)
         self.cells = [[Cell(self, x, y) for x in xrange(grid.width)]
                       for y in xrange(grid.height)]
-        self.constraints = list(reversed(
+        self.constraints = (
             [LineConstraint(self, proj, cells,
                             direction=Direction.ROW,
                             coord=i)
@@ -20,25 +67,69 @@ class NonogramProblem:
                             direction=Direction.COLUMN,
                             coord=i)
              for i, proj in enumerate(grid.columns)]
-        ))
+        )
 
-        self.dirty_constraints = self.constraints[:]
+        self.dirty_constraints = queue(self.constraints)
         self.state_stack = [] # Used for backtracking
+        self.trail = [] # Cells changed since the first choice point, with their old states
+        self.blank_count = grid.width * grid.height
+        self.free_per_row = [grid.width] * grid.height
+        self.free_per_col = [grid.height] * grid.width
+        self.brancher = brancher(self, value_order=value_order)
+        # With learning, cells remember which choice points they depend on as a
+        # bit mask of stack levels. This is the mask for cells set from now on.
+        self.reason = 0
+        self.nogoods = deque(maxlen=nogood_limit)
         self.branching_attempts = 0
+        # What the counter was at when the search was restored, since node
+        # budgets only count the attempts made after it
+        self.restored_attempts = 0
+        self.line_solves = 0
+        self.steps = 0
+        # Kept across calls to solve(), which may only take a few steps each
+        # when counting solutions
+        self.next_check = self.check_interval
 
     def next_constraint(self):
-        return self.dirty_constraints and self.dirty_constraints[-1]
+        return self.dirty_constraints.peek()
 
-    def solve(self, abort_time=None):
+    # Raises a BudgetException if it runs out of time (or the budget runs
+    # out), leaving the problem where it stopped
+    def solve(self, abort_time=None, budget=None):
+        if budget is None:
+            budget = Budget(abort_time) if abort_time else None
+        if not budget:
+            while self.step():
+                pass
+            return
         while self.step():
-            if abort_time and time.clock() > abort_time:
-                raise TimeoutException()
+            if self.steps >= self.next_check:
+                budget.check(self)
+                self.next_check = self.steps + self.check_interval
+
+    # How far the search has got: the cells determined, those of them that
+    # don't depend on any guess (and so are known to be right), and how deep
+    # the search is
+    def progress(self):
+        cells = self.grid.width * self.grid.height
+        determined = cells - self.blank_count
+        settled = determined
+        if self.state_stack:
+            # The trail holds every change since the first guess
+            mark = self.state_stack[0]['trail_mark']
+            settled -= sum(1 for _, state in self.trail[mark:] if state is None)
+        return progress_entry(self, cells, determined, settled)
 
     def step(self, debug=False):
+        self.steps += 1
         if not self.dirty_constraints:
-            blank_cells = self.blank_cells()
-            if blank_cells:
-                self.branch(blank_cells)
+            if self.blank_count:
+                if self.nogoods and self.check_nogoods():
+                    return True
+                try:
+                    self.branch()
+                except InconsistencyException:
+                    self.backtrack()
                 return True
             else:
                 return False
@@ -47,100 +138,302 @@ class NonogramProblem:
         try:
             constraint.step(debug)
         except InconsistencyException:
-            self.backtrack()
+            # The line can't be solved given the cells that were known going in
+            self.backtrack(self.reason if self.learning else None)
         return True
 
-    def branch(self, blank_cells):
+    def propagate(self):
+        while self.dirty_constraints:
+            try:
+                self.dirty_constraints.pop().step()
+            except InconsistencyException:
+                return False
+        return True
+
+    def branch(self):
+        self.brancher.branch()
+
+    def choose(self, cell, value):
         self.branching_attempts += 1
-        cell, value = self.choose_branch(blank_cells)
+        if not self.state_stack:
+            # Nothing before the first choice point is ever undone
+            del self.trail[:]
+        self.state_stack.append({
+            'branch_cell': cell,
+            'value': value,
+            'trail_mark': len(self.trail),
+        })
+        self.assign(cell, value, 1 << len(self.state_stack))
+
+    def force(self, cell, value):
+        # Without a better explanation, the value depends on every choice so far
+        self.assign(cell, value, self.decisions())
+
+    def assign(self, cell, value, reason):
+        self.reason = reason
         if value:
             cell.fill()
         else:
             cell.cross()
-        self.state_stack.append(self.freeze_state(cell))
-
-    def choose_branch(self, blank_cells):
-        free_per_row = [0 for _ in xrange(self.grid.height)]
-        free_per_col = [0 for _ in xrange(self.grid.width)]
-        for cell in blank_cells:
-            free_per_row[cell.y] += 1
-            free_per_col[cell.x] += 1
-        cell = min(blank_cells, key=lambda c: free_per_col[c.x] + free_per_row[c.y])
-        return cell, True
-
-    def freeze_state(self, branch_cell):
-        return {
-            'branch_cell': branch_cell,
-            'state': [[cell.state for cell in row] for row in self.cells],
-        }
 
-    def backtrack(self):
+    # Returns how many cells get determined by setting the cell to the value,
+    # or None if that leads to a contradiction
+    def probe(self, cell, value):
+        trail_mark = len(self.trail)
+        blank_count = self.blank_count
+        self.force(cell, value)
+        consistent = self.propagate()
+        determined = blank_count - self.blank_count
+        self.undo(trail_mark)
+        return determined if consistent else None
+
+    def decisions(self):
+        return (1 << (len(self.state_stack) + 1)) - 2
+
+    def backtrack(self, conflict=None):
         if not self.state_stack:
             raise InconsistencyException()
+        if self.learning:
+            self.backjump(conflict if conflict is not None else self.decisions())
+            return
         last_state = self.state_stack.pop()
-        self.restore_and_toggle(last_state)
+        self.undo(last_state['trail_mark'])
+        if last_state['value']:
+            last_state['branch_cell'].cross()
+        else:
+            last_state['branch_cell'].fill()
 
-    def restore_and_toggle(self, state):
-        while self.dirty_constraints:
-            self.dirty_constraints.pop().dirty = False
-        for row, frozen_row in zip(self.cells, state['state']):
-            for cell, frozen_state in zip(row, frozen_row):
-                cell.state = frozen_state
-                if frozen_state == True:
-                    self.grid[cell.x,cell.y] = 1
-                elif frozen_state == False:
-                    self.grid[cell.x,cell.y] = 0
+    # Undoes every choice back to the latest one the conflict depends on and
+    # flips that one, which then depends on the other choices involved
+    def backjump(self, conflict):
+        if not conflict:
+            raise InconsistencyException()
+        levels = [level for level in xrange(1, conflict.bit_length())
+                  if (conflict >> level) & 1]
+        self.nogoods.append([(self.state_stack[level - 1]['branch_cell'],
+                              self.state_stack[level - 1]['value']) for level in levels])
+        culprit = levels.pop()
+        level = levels[-1] if levels else 0
+        last_state = self.state_stack[culprit - 1]
+        trail_mark = self.state_stack[level]['trail_mark']
+        del self.state_stack[level:]
+        self.undo(trail_mark)
+        self.assign(last_state['branch_cell'], not last_state['value'],
+                    conflict & ~(1 << culprit))
+
+    # Learned no-goods are combinations of cell values that can't all hold.
+    # Returns whether one of them forced a cell or a backjump.
+    def check_nogoods(self):
+        for nogood in self.nogoods:
+            blank = None
+            reason = 0
+            for cell, value in nogood:
+                if cell.state is None:
+                    if blank is not None:
+                        break
+                    blank = cell, value
+                elif cell.state != value:
+                    break
                 else:
-                    self.grid[cell.x,cell.y] = None
-        if state['branch_cell'].state:
-            state['branch_cell'].cross()
-        else:
-            state['branch_cell'].fill()
+                    reason |= cell.reason
+            else:
+                if blank is None:
+                    self.backtrack(reason)
+                else:
+                    cell, value = blank
+                    self.assign(cell, not value, reason)
+                return True
+        return False
+
+    def undo(self, trail_mark):
+        while self.dirty_constraints:
+            constraint = self.dirty_constraints.pop()
+            constraint.dirty = False
+            constraint.changed = []
+        # Only the cells changed since the choice point need to be restored
+        while len(self.trail) > trail_mark:
+            cell, state = self.trail.pop()
+            if state is None:
+                self.blank_count += 1
+                self.free_per_row[cell.y] += 1
+                self.free_per_col[cell.x] += 1
+            cell.state = state
+            # Lines that lose information may have new leftmost/rightmost placements
+            cell.row.placements = None
+            cell.column.placements = None
+            if state == True:
+                self.grid[cell.x,cell.y] = 1
+            elif state == False:
+                self.grid[cell.x,cell.y] = 0
+            else:
+                self.grid[cell.x,cell.y] = None
+
+    # Everything needed to carry on the search from between two steps, as
+    # plain data that can be saved as JSON. Cells and lines are referred to by
+    # their index (cells row by row, then lines as in self.constraints).
+    def checkpoint(self):
+        cells = [cell for row in self.cells for cell in row]
+        index = dict((cell, i) for i, cell in enumerate(cells))
+        # Emptying the queue gives its order, and refilling it in that order
+        # gives the same queue back
+        queued = []
+        while self.dirty_constraints:
+            queued.append(self.dirty_constraints.pop())
+        for constraint in queued:
+            self.dirty_constraints.push(constraint)
+        return {
+            'rows': self.grid.rows,
+            'columns': self.grid.columns,
+            'cells': [cell.state for cell in cells],
+            'reasons': [cell.reason for cell in cells],
+            'trail': [(index[cell], state) for cell, state in self.trail],
+            'stack': [{
+                'cell': index[state['branch_cell']],
+                'value': state['value'],
+                'trail_mark': state['trail_mark'],
+            } for state in self.state_stack],
+            'lines': [(constraint.changed, constraint.placements)
+                      for constraint in self.constraints],
+            'queue': [self.constraints.index(constraint) for constraint in queued],
+            'reason': self.reason,
+            'nogoods': [[(index[cell], value) for cell, value in nogood]
+                        for nogood in self.nogoods],
+            'branching_attempts': self.branching_attempts,
+            'line_solves': self.line_solves,
+            'steps': self.steps,
+            'options': self.search_options(),
+        }
+
+    # The options the saved state depends on, by name. The reasons on the
+    # cells are only kept with learning, the line placements only when
+    # incremental, and so on.
+    def search_options(self):
+        return {
+            'line_solver': self.line_solver.__name__,
+            'incremental': self.incremental,
+            'queue': self.dirty_constraints.__class__.__name__,
+            'brancher': self.brancher.__class__.__name__,
+            'value_order': self.brancher.value_order.__name__,
+            'learning': self.learning,
+        }
 
+    # Picks up from a checkpoint of the same puzzle, made with the same options
+    def restore(self, checkpoint):
+        if (map(list, checkpoint['rows']) != map(list, self.grid.rows) or
+                map(list, checkpoint['columns']) != map(list, self.grid.columns)):
+            raise ValueError('The checkpoint is for a different puzzle')
+        options = self.search_options()
+        saved = checkpoint.get('options', {})
+        changed = sorted(key for key in options if saved.get(key) != options[key])
+        if changed:
+            raise ValueError('The checkpoint was made with different solver options (%s)' %
+                             ', '.join('%s: %s, not %s' % (key, saved.get(key), options[key])
+                                       for key in changed))
+        cells = [cell for row in self.cells for cell in row]
+        for cell, state, reason in zip(cells, checkpoint['cells'], checkpoint['reasons']):
+            cell.state = state
+            cell.reason = reason
+            if state is not None:
+                self.determined(cell)
+                self.grid[cell.x,cell.y] = 1 if state else 0
+        self.trail = [(cells[i], state) for i, state in checkpoint['trail']]
+        self.state_stack = [{
+            'branch_cell': cells[state['cell']],
+            'value': state['value'],
+            'trail_mark': state['trail_mark'],
+        } for state in checkpoint['stack']]
+        for constraint, (changed, placements) in zip(self.constraints, checkpoint['lines']):
+            constraint.changed = list(changed)
+            constraint.placements = tuple(placements) if placements is not None else None
+            constraint.dirty = False
+        queued = [self.constraints[i] for i in checkpoint['queue']]
+        for constraint in queued:
+            constraint.dirty = True
+        self.dirty_constraints = self.dirty_constraints.__class__(queued)
+        self.reason = checkpoint['reason']
+        self.nogoods.clear()
+        self.nogoods.extend([(cells[i], value) for i, value in nogood]
+                            for nogood in checkpoint['nogoods'])
+        self.branching_attempts = self.restored_attempts = checkpoint['branching_attempts']
+        self.line_solves = checkpoint['line_solves']
+        self.steps = checkpoint['steps']
+        self.next_check = self.steps + self.check_interval
 
     def mark_dirty(self, constraint):
-        self.dirty_constraints.insert(0, constraint)
+        self.dirty_constraints.push(constraint)
 
-    def blank_cells(self):
-        cells = []
-        for row in self.cells:
-            for cell in row:
-                if cell.state is None:
-                    cells.append(cell)
-        return cells
+    def determined(self, cell):
+        self.blank_count -= 1
+        self.free_per_row[cell.y] -= 1
+        self.free_per_col[cell.x] -= 1
+
+def progress_entry(problem, cells, determined, settled):
+    return {
+        'cells': cells,
+        'determined': determined,
+        'settled': settled,
+        'resolved': float(settled) / cells if cells else 1.0,
+        'depth': len(problem.state_stack),
+        'branching_attempts': problem.branching_attempts,
+        'line_solves': problem.line_solves,
+        'steps': problem.steps,
+    }
+
+# There's one of these per cell, so they have slots rather than an instance
+# dict, and refer to their row and column constraints directly
+class Cell(object):
+    __slots__ = ('problem', 'x', 'y', 'row', 'column', 'state', 'reason')
 
-class Cell:
     def __init__(self, problem, x, y):
         self.problem = problem
         self.x = x
         self.y = y
-        self.constraints = {}
+        self.row = None
+        self.column = None
         self.state = None
+        self.reason = 0
 
     def fill(self, direction=None):
         if self.state != True:
+            self.problem.trail.append((self, self.state))
+            if self.state is None:
+                self.problem.determined(self)
+            if self.problem.learning:
+                self.reason = self.problem.reason
             self.mark_dirty(direction)
         self.state = True
         self.problem.grid[self.x,self.y] = 1
 
     def cross(self, direction=None):
         if self.state != False:
+            self.problem.trail.append((self, self.state))
+            if self.state is None:
+                self.problem.determined(self)
+            if self.problem.learning:
+                self.reason = self.problem.reason
             self.mark_dirty(direction)
         self.state = False
         self.problem.grid[self.x,self.y] = 0
 
     def mark_dirty(self, direction=None):
-        for d, constraint in self.constraints.iteritems():
-            if d != direction:
-                constraint.mark_dirty()
+        if direction != Direction.ROW:
+            self.row.mark_dirty(self)
+        if direction != Direction.COLUMN:
+            self.column.mark_dirty(self)
 
     def add_constraint(self, constraint, direction):
-        self.constraints[direction] = constraint
+        if direction == Direction.ROW:
+            self.row = constraint
+        else:
+            self.column = constraint
 
     def __nonzero__(self):
         return bool(self.state)
 
-class LineConstraint:
+class LineConstraint(object):
+    __slots__ = ('problem', 'proj', 'width', 'cells', 'direction', 'coord', 'dirty',
+                 'placements', 'changed', 'slack')
+
     def __init__(self, problem, proj, cells, direction, coord):
         self.problem = problem
         self.proj = proj
@@ -151,6 +444,11 @@ class LineConstraint:
         for cell in self.cells:
             cell.add_constraint(self, direction)
         self.dirty = True
+        # Masks of the cells covered by the leftmost and rightmost placements
+        # from the last solve, and the indices of cells changed since then
+        self.placements = None
+        self.changed = []
+        self.slack = self.width - sum(proj) - max(len(proj) - 1, 0)
 
     def step(self, debug=False):
         if debug:
@@ -159,13 +457,44 @@ class LineConstraint:
         self.constrain()
 
     def constrain(self):
-        solver = LineSolver(self.cells, self.direction)
-        solver.solve(self.proj)
+        changed = self.changed
+        self.changed = []
+        if self.placements is not None and self.problem.incremental:
+            left, right = self.placements
+            for i in changed:
+                state = self.cells[i].state
+                if (left >> i) & 1 != state or (right >> i) & 1 != state:
+                    break
+            else:
+                # The placements are still valid, so they would only lead to
+                # the deductions we've already made
+                return
 
-    def mark_dirty(self):
+        self.placements = None
+        self.problem.line_solves += 1
+        if self.problem.learning:
+            reason = 0
+            for cell in self.cells:
+                if cell.state is not None:
+                    reason |= cell.reason
+            self.problem.reason = reason
+        if self.problem.line_cache is not None:
+            placements = self.problem.line_cache.solve(self.problem.line_solver, self.cells,
+                                                       self.direction, self.proj)
+        else:
+            solver = self.problem.line_solver(self.cells, self.direction)
+            placements = solver.solve(self.proj)
+        if placements is not None:
+            left, right = placements
+            self.placements = (placement_mask(self.proj, left), placement_mask(self.proj, right))
+
+    def mark_dirty(self, cell):
+        self.changed.append(cell.x if self.direction == Direction.ROW else cell.y)
         if not self.dirty:
             self.dirty = True
             self.problem.mark_dirty(self)
+        else:
+            self.problem.dirty_constraints.update(self)
 
 
 
@@ -0,0 +1,181 @@
+import select
+import time
+
+from nonogram import Grid
+from parallel import Worker, WorkerError
+from solve import NonogramProblem
+from util import InconsistencyException, TimeoutException
+
+# Splits the search for one puzzle across worker processes. A subproblem is
+# just the states of all the cells (row by row), so it can be sent anywhere
+# and solved from scratch. The search is first split at the shallowest
+# choice points until there are a few subproblems per worker. After that, a
+# worker that has searched for a while hands back what it has left: the
+# node it's at, which it carries on with, and the other value of every
+# choice on its stack, which idle workers take up.
+class SplitSearch:
+    def __init__(self, grid, jobs, count=None, split_steps=2000, tasks_per_job=2, **options):
+        self.grid = grid
+        self.jobs = jobs
+        # None to stop at the first solution, otherwise a limit on how many
+        # to count (0 for all of them)
+        self.count = count
+        self.split_steps = split_steps
+        self.tasks_per_job = tasks_per_job
+        # Backjumping would leave the stack unfit for splitting
+        options['learning'] = False
+        self.options = options
+
+    def solve(self, timeout=None):
+        self.solutions = 0
+        self.tasks_run = 0
+        self.tasks_split = 0
+        self.branching_attempts = 0
+        self.line_solves = 0
+        self.steps = 0
+        self.first = None
+        deadline = time.time() + timeout if timeout else None
+        tasks = self.seed([[None] * (self.grid.width * self.grid.height)])
+        if not self.done():
+            self.run(tasks, deadline)
+        if self.first is not None:
+            self.grid.grid = self.first
+        elif self.count is None:
+            raise InconsistencyException()
+        if self.count:
+            # Workers running at the same time can find more between them
+            return min(self.solutions, self.count)
+        return self.solutions
+
+    # Splits breadth first in this process until there's enough to go round
+    def seed(self, tasks):
+        while tasks and len(tasks) < self.jobs * self.tasks_per_job and not self.done():
+            self.add_outcome(self.explore(tasks.pop(0), split_depth=1))
+            tasks.extend(self.outcome_tasks)
+        return tasks
+
+    def run(self, tasks, deadline):
+        workers = [Worker(explore) for _ in xrange(self.jobs)]
+        try:
+            # The deepest subproblems are at the front
+            tasks.reverse()
+            for worker in workers:
+                if tasks:
+                    self.assign(worker, tasks.pop())
+            while not self.done():
+                busy = [worker for worker in workers if worker.key is not None]
+                if not busy:
+                    break
+                # Workers that keep handing back subproblems never leave
+                # select() waiting, so the deadline is checked every time
+                if deadline is not None and time.time() >= deadline:
+                    raise TimeoutException()
+                wait = max(0, deadline - time.time()) if deadline else None
+                ready, _, _ = select.select([worker.conn for worker in busy], [], [], wait)
+                if not ready:
+                    raise TimeoutException()
+                for worker in busy:
+                    if worker.conn not in ready:
+                        continue
+                    outcome = worker.receive()
+                    if isinstance(outcome, WorkerError):
+                        raise outcome
+                    self.add_outcome(outcome)
+                    if self.outcome_tasks:
+                        # Carry on from the same node, and leave the rest for
+                        # whichever workers are idle, shallowest first
+                        self.tasks_split += 1
+                        tasks.extend(self.outcome_tasks[1:])
+                        self.assign(worker, self.outcome_tasks[0])
+                for worker in workers:
+                    if worker.key is None and tasks:
+                        self.assign(worker, tasks.pop())
+        finally:
+            for worker in workers:
+                worker.stop()
+
+    def assign(self, worker, states):
+        self.tasks_run += 1
+        worker.assign(self.tasks_run, (self.grid.rows, self.grid.columns, states, self.options,
+                                       self.limit(), self.split_steps))
+
+    def explore(self, states, split_depth=None):
+        self.tasks_run += 1
+        return explore(self.grid.rows, self.grid.columns, states, self.options, self.limit(),
+                       None, split_depth)
+
+    # How many more solutions a subproblem should look for
+    def limit(self):
+        if not self.count:
+            return self.count
+        return self.count - self.solutions
+
+    def add_outcome(self, outcome):
+        self.solutions += outcome['solutions']
+        if self.first is None:
+            self.first = outcome['grid']
+        self.branching_attempts += outcome['branching_attempts']
+        self.line_solves += outcome['line_solves']
+        self.steps += outcome['steps']
+        self.outcome_tasks = outcome['open']
+
+    def done(self):
+        if self.count is None:
+            return self.solutions > 0
+        return bool(self.count) and self.solutions >= self.count
+
+
+# Searches the subproblem for the given number of steps, or until a choice is
+# made at the split depth, and returns what it found along with the
+# subproblems left to search. Either way it goes on until it has made a choice.
+def explore(rows, columns, states, options, count, steps=None, split_depth=None):
+    grid = Grid(len(columns), len(rows), rows=rows, columns=columns)
+    problem = NonogramProblem(grid, **options)
+    cells = [cell for row in problem.cells for cell in row]
+    outcome = {
+        'solutions': 0,
+        'grid': None,
+        'open': [],
+    }
+    try:
+        for cell, state in zip(cells, states):
+            if state:
+                cell.fill()
+            elif state is not None:
+                cell.cross()
+        while True:
+            # Only split once there's a choice to hand out, so every
+            # subproblem gets somewhere
+            if problem.state_stack and ((steps is not None and problem.steps >= steps) or
+                                        (split_depth is not None and
+                                         len(problem.state_stack) >= split_depth)):
+                outcome['open'] = open_subproblems(problem, cells)
+                break
+            if not problem.step():
+                outcome['solutions'] += 1
+                if outcome['grid'] is None:
+                    outcome['grid'] = [row[:] for row in grid.grid]
+                if count is None or (count and outcome['solutions'] >= count):
+                    break
+                problem.backtrack()
+    except InconsistencyException:
+        # Nothing left to search
+        pass
+    outcome['branching_attempts'] = problem.branching_attempts
+    outcome['line_solves'] = problem.line_solves
+    outcome['steps'] = problem.steps
+    return outcome
+
+# The node the search is at, then the other value of each choice on the
+# stack from the deepest to the shallowest. Together they cover everything
+# the search hasn't been through yet.
+def open_subproblems(problem, cells):
+    subproblems = [[cell.state for cell in cells]]
+    width = problem.grid.width
+    for state in reversed(problem.state_stack):
+        problem.undo(state['trail_mark'])
+        states = [cell.state for cell in cells]
+        branch_cell = state['branch_cell']
+        states[branch_cell.y * width + branch_cell.x] = not state['value']
+        subproblems.append(states)
+    return subproblems
@@ -0,0 +1,132 @@
+import sys
+import time
+from collections import defaultdict
+
+# Bytes of one trail entry: the (cell, old state) tuple and its slot in the list
+TRAIL_ENTRY_BYTES = sys.getsizeof((None, None)) + 8
+
+# Counts and times what a problem spends its time on. Nothing is measured
+# unless a problem is instrumented: this replaces the methods of that one
+# problem with timed versions, so uninstrumented problems run as before.
+# Phase times nest, e.g. probing line solves count towards the branch time.
+class SolverStats:
+    def __init__(self, problem):
+        self.problem = problem
+        problem.stats = self
+        self.counters = defaultdict(lambda: 0)
+        self.times = defaultdict(lambda: 0.0)
+        self.max_depth = 0
+        self.max_trail = 0
+
+        self._wrap(problem, 'branch', 'branch', self._after_branch)
+        self._wrap(problem, 'backtrack', 'backtrack', self._before_backtrack)
+        self._wrap(problem, 'check_nogoods', 'nogoods')
+        if hasattr(problem, 'constraints'):
+            # Constraints have slots, so there's no instance dict to put a
+            # timed method in
+            for constraint in problem.constraints:
+                constraint.__class__ = timed_constraint(constraint.__class__)
+            problem.line_solver = timed_line_solver(problem.line_solver)
+        else:
+            # The NumPy backend solves whole batches of lines at a time
+            self._wrap(problem, 'propagate', 'line', self._count_batch)
+
+    def _wrap(self, target, name, phase, hook=None):
+        method = getattr(target, name, None)
+        if method is None:
+            return
+        times = self.times
+        counters = self.counters
+        def timed(*args, **kwargs):
+            after = hook() if hook else None
+            start_time = time.clock()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                times[phase] += time.clock() - start_time
+                counters[phase] += 1
+                if after is not None:
+                    after()
+        setattr(target, name, timed)
+
+    # Hooks run before a wrapped method and may return a function to run after it
+    def _after_branch(self):
+        def after():
+            self.max_depth = max(self.max_depth, len(self.problem.state_stack))
+        return after
+
+    def _before_backtrack(self):
+        self.max_trail = max(self.max_trail, len(getattr(self.problem, 'trail', ())))
+
+    def _count_batch(self):
+        problem = self.problem
+        unknown = (problem.board == -1).sum()
+        def after():
+            self.counters['deduced'] += unknown - (problem.board == -1).sum()
+        return after
+
+    def report(self):
+        problem = self.problem
+        counters = self.counters
+        line_solves = problem.line_solves
+        if hasattr(problem, 'trail'):
+            snapshot_bytes = max(self.max_trail, len(problem.trail)) * TRAIL_ENTRY_BYTES
+        else:
+            snapshot_bytes = self.max_depth * problem.board.nbytes
+        return {
+            'line_solves': line_solves,
+            'deduced_per_line_solve': (float(counters['deduced']) / line_solves
+                                       if line_solves else 0.0),
+            'branches': counters['branch'],
+            'backtracks': counters['backtrack'],
+            'max_depth': self.max_depth,
+            'snapshot_bytes': snapshot_bytes,
+            'times': dict(self.times),
+        }
+
+
+_timed_constraints = {}
+
+# A subclass of the constraint that times solving the line and counts the
+# cells it determines. Instrumented problems switch their constraints over.
+def timed_constraint(constraint_class):
+    if constraint_class not in _timed_constraints:
+        class TimedConstraint(constraint_class):
+            __slots__ = ()
+
+            def constrain(self):
+                problem = self.problem
+                blank_count = problem.blank_count
+                start_time = time.clock()
+                try:
+                    return constraint_class.constrain(self)
+                finally:
+                    problem.stats.times['line'] += time.clock() - start_time
+                    problem.stats.counters['line'] += 1
+                    problem.stats.counters['deduced'] += blank_count - problem.blank_count
+        _timed_constraints[constraint_class] = TimedConstraint
+    return _timed_constraints[constraint_class]
+
+
+_timed_line_solvers = {}
+
+# A subclass of the line solver that times setting up a line (splitting it
+# into spans for LineSolver) separately from solving it. There is only one
+# per line solver, so instrumented problems can still share a line cache.
+def timed_line_solver(line_solver):
+    if line_solver not in _timed_line_solvers:
+        class TimedLineSolver(line_solver):
+            def __init__(self, cells, direction):
+                start_time = time.clock()
+                line_solver.__init__(self, cells, direction)
+                self.stats = cells[0].problem.stats
+                self.stats.times['line_setup'] += time.clock() - start_time
+
+            def solve(self, runs):
+                start_time = time.clock()
+                try:
+                    return line_solver.solve(self, runs)
+                finally:
+                    self.stats.times['line_solver'] += time.clock() - start_time
+        _timed_line_solvers[line_solver] = TimedLineSolver
+    return _timed_line_solvers[line_solver]
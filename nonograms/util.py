@@ -1,9 +1,54 @@
+import resource
+import time
+
 class InconsistencyException(RuntimeError):
     pass
 
-class TimeoutException(RuntimeError):
+# The solve ran out of something it was only allowed so much of
+class BudgetException(RuntimeError):
+    pass
+
+class TimeoutException(BudgetException):
+    pass
+
+class NodeBudgetException(BudgetException):
+    pass
+
+class MemoryBudgetException(BudgetException):
     pass
 
 class Direction:
     ROW = 0
     COLUMN = 1
+
+# Limits on a solve: a time.clock() deadline, a number of branching
+# attempts (since the search was started or restored), and the memory the
+# process is using in MB. Solvers only check them every so many steps,
+# since looking at the clock on every step costs more than most steps do.
+class Budget:
+    def __init__(self, abort_time=None, max_nodes=None, max_memory=None):
+        self.abort_time = abort_time
+        self.max_nodes = max_nodes
+        self.max_memory = max_memory
+
+    def __nonzero__(self):
+        return (self.abort_time is not None or self.max_nodes is not None or
+                self.max_memory is not None)
+
+    def check(self, problem):
+        if self.abort_time is not None and time.clock() > self.abort_time:
+            raise TimeoutException()
+        if (self.max_nodes is not None and problem.branching_attempts -
+                getattr(problem, 'restored_attempts', 0) >= self.max_nodes):
+            raise NodeBudgetException()
+        if self.max_memory is not None and memory_use() > self.max_memory:
+            raise MemoryBudgetException()
+
+# The resident size of the process right now, in MB. Without /proc there's
+# only the peak so far (ru_maxrss, in KB on Linux), which never goes down.
+def memory_use():
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / (1024.0 * 1024)
+    except IOError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
@@ -1,46 +1,127 @@
 from lxml import html
+from multiprocessing.pool import ThreadPool
 from tqdm import tqdm
+from urlparse import urljoin
+import argparse
 import json
-import os
 import re
 import requests
-import sys
+import threading
+import time
 
-from nonograms.data import JsonGridData
+from nonograms.data import JsonLinesGridData, INDEX_PATH, NONOGRAMS_PATH
 from nonograms.nonogram import Grid
 
-DATA_DIR = 'data'
-INDEX_PATH = os.path.join(DATA_DIR, 'index.json')
-NONOGRAMS_PATH = os.path.join(DATA_DIR, 'nonograms.json')
+BASE_URL = 'http://www.nonograms.org/'
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# A pooled session shared by several threads, with a limit on the request
+# rate across all of them, and retries with exponential backoff
+class Fetcher:
+    def __init__(self, jobs=8, rate=None, retries=3, backoff=1.0, timeout=30):
+        self.jobs = jobs
+        self.rate = rate
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=jobs)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.lock = threading.Lock()
+        self.next_request = 0
+
+    def get(self, url):
+        for attempt in xrange(self.retries + 1):
+            self.wait()
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+                if response.status_code not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    return response
+                error = requests.HTTPError('%s error for %s' % (response.status_code, url),
+                                           response=response)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            if attempt < self.retries:
+                time.sleep(self.backoff * 2 ** attempt)
+        raise error
+
+    def wait(self):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.time()
+            start = max(now, self.next_request)
+            self.next_request = start + 1.0 / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+    # Calls the function on each item in a pool of threads and yields
+    # (item, result, error) as each one finishes
+    def map(self, function, items):
+        def call(item):
+            try:
+                return item, function(item), None
+            except Exception as e:
+                return item, None, e
+        pool = ThreadPool(self.jobs)
+        try:
+            for outcome in pool.imap_unordered(call, items):
+                yield outcome
+        finally:
+            pool.terminate()
+
 
 class NonogramDiscovery:
-    URL = 'http://www.nonograms.org/nonograms/p/{page}/sort/6'
+    PATH = 'nonograms/p/{page}/sort/6'
 
-    def __init__(self):
+    def __init__(self, fetcher, base_url=BASE_URL):
+        self.fetcher = fetcher
+        self.base_url = base_url
         self.index = {}
 
     def discover_all(self):
+        # Read as many pages at a time as there are threads, but go through
+        # them in order, since the first page repeating puzzles ends the list
         page_num = 1
-        while self.read_page(page_num):
-            page_num += 1
+        done = False
+        while not done:
+            pages = range(page_num, page_num + self.fetcher.jobs)
+            entries = dict((page, (result, error)) for page, result, error in
+                           self.fetcher.map(self.read_page, pages))
+            for page in pages:
+                result, error = entries[page]
+                if error:
+                    raise error
+                if not self.add_entries(result):
+                    done = True
+                    break
+            page_num += len(pages)
         with open(INDEX_PATH, 'w') as f:
             json.dump(self.index, f)
         print('Wrote index to %s' % INDEX_PATH)
 
+    def add_entries(self, entries):
+        for nid, params in entries:
+            if nid in self.index:
+                return False
+            self.index[nid] = params
+        return True
+
     def read_page(self, page_num):
         print('Reading page %d' % page_num)
-        page = requests.get(self.URL.format(page=page_num))
+        page = self.fetcher.get(urljoin(self.base_url, self.PATH.format(page=page_num)))
         tree = html.fromstring(page.content)
         descriptions = tree.cssselect('table.nonogram_list > tr > td.nonogram_descr')
+        entries = []
         for description in descriptions:
             try:
-                nid, params = self.extract_params(description)
-                if nid in self.index:
-                    return False
-                self.index[nid] = params
+                entries.append(self.extract_params(description))
             except Exception as e:
                 print(e)
-        return True
+        return entries
 
     def extract_params(self, description):
         title_el = description.cssselect('.nonogram_title')[0]
@@ -59,14 +140,15 @@ class NonogramDiscovery:
 class NonogramDownloader:
     PATTERN = re.compile('^var d=(?P<values>[\d\s,\[\]]+);?$')
 
-    def __init__(self, url):
+    def __init__(self, url, fetcher):
         self.url = url
+        self.fetcher = fetcher
 
     def retrieve(self):
         return self.decode(self.fetch_values())
 
     def fetch_values(self):
-        page = requests.get(self.url)
+        page = self.fetcher.get(self.url)
         tree = html.fromstring(page.content)
         scripts = tree.xpath('//script')
         for script in scripts:
@@ -82,7 +164,7 @@ class NonogramDownloader:
         width = v[1][0] % v[1][3] + v[1][1] % v[1][3] - v[1][2] % v[1][3]
         height = v[2][0] % v[2][3] + v[2][1] % v[2][3] - v[2][2] % v[2][3]
         Aa = v[3][0] % v[3][3] + v[3][1] % v[3][3] - v[3][2] % v[3][3]
-        grid = Grid(width, height)
+        solution = [[0] * width for _ in xrange(height)]
 
         V = Aa + 5
         Ha = v[V][0] % v[V][3] * (v[V][0] % v[V][3]) + v[V][1] % v[V][3] * 2 + v[V][2] % v[V][3]
@@ -90,30 +172,68 @@ class NonogramDownloader:
 
         for u in range(V + 2, V + 1 + Ha + 1):
             for y in range(v[u][0] - Ia[0] - 1, v[u][0] - Ia[0] + v[u][1] - Ia[1] - 1):
-                grid[y, v[u][3] - Ia[3] - 1] = v[u][2] - Ia[2]
+                solution[v[u][3] - Ia[3] - 1][y] = v[u][2] - Ia[2]
 
-        return grid
+        # Project the clues only once the whole solution is known
+        return Grid(width, height, solution)
 
+# Downloads the indexed puzzles that aren't saved yet. Each one is appended to
+# the puzzle data as soon as it arrives, so an interrupted sync picks up where
+# it left off.
 class NonogramSync:
-    def __init__(self):
+    def __init__(self, fetcher, base_url=BASE_URL, data_path=NONOGRAMS_PATH):
         with open(INDEX_PATH, 'r') as f:
             self.index = json.load(f)
-        self.data = JsonGridData()
+        self.fetcher = fetcher
+        self.base_url = base_url
+        self.data_path = data_path
+        self.data = JsonLinesGridData(data_path, create=True)
 
     def sync(self):
-        for nid, props in tqdm(self.index.iteritems(), total=len(self.index)):
-            try:
-                grid = NonogramDownloader(props['url']).retrieve()
+        missing = sorted(nid for nid in self.index if nid not in self.data)
+        print('%s of %s puzzles left to download' % (len(missing), len(self.index)))
+        try:
+            for nid, grid, error in tqdm(self.fetcher.map(self.retrieve, missing),
+                                         total=len(missing)):
+                if error:
+                    print('%s: %s' % (nid, error))
+                    continue
                 self.data.store(nid, grid)
-            except Exception as e:
-                print(e)
-        self.data.save(NONOGRAMS_PATH)
-        print('Wrote nonograms to %s' % NONOGRAMS_PATH)
+        finally:
+            self.data.close()
+        print('Wrote nonograms to %s' % self.data_path)
+
+    def retrieve(self, nid):
+        url = urljoin(self.base_url, self.index[nid]['url'])
+        return NonogramDownloader(url, self.fetcher).retrieve()
 
 if __name__ == '__main__':
-    if len(sys.argv) > 1 and sys.argv[1] == 'discover':
-        NonogramDiscovery().discover_all()
-    elif len(sys.argv) > 1 and sys.argv[1] == 'sync':
-        NonogramSync().sync()
+    parser = argparse.ArgumentParser(description='Download nonograms.')
+    parser.add_argument('action',
+                        choices=['discover', 'sync'],
+                        help='discover indexes the puzzles, sync downloads them')
+    parser.add_argument('-j', '--jobs',
+                        default=8,
+                        type=int,
+                        help='concurrent requests (default: 8)')
+    parser.add_argument('-r', '--rate',
+                        default=None,
+                        type=float,
+                        help='maximum requests per second (default: no limit)')
+    parser.add_argument('--retries',
+                        default=3,
+                        type=int,
+                        help='times to retry a failed request, with exponential backoff (default: 3)')
+    parser.add_argument('--base-url',
+                        default=BASE_URL,
+                        help='the site to download from (default: %s)' % BASE_URL)
+    parser.add_argument('--data',
+                        default=NONOGRAMS_PATH,
+                        help='the .jsonl file sync adds puzzles to (default: %s)' % NONOGRAMS_PATH)
+    args = parser.parse_args()
+
+    fetcher = Fetcher(jobs=args.jobs, rate=args.rate, retries=args.retries)
+    if args.action == 'discover':
+        NonogramDiscovery(fetcher, args.base_url).discover_all()
     else:
-        print('Nothing to do')
+        NonogramSync(fetcher, args.base_url, args.data).sync()
@@ -0,0 +1,145 @@
+import BaseHTTPServer
+import SocketServer
+import argparse
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+
+import scrape
+from nonograms.data import JsonLinesGridData, NONOGRAMS_PATH
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'scrape_fixtures')
+
+LISTING = re.compile('^/nonograms/p/(\d+)/sort/6$')
+PUZZLE = re.compile('^/nonograms/i/(\d+)$')
+
+# Serves the fixture pages like the real site: listing pages past the last
+# one repeat it, and puzzle pages can be made to fail. Puzzles in `flaky`
+# answer 503 to their first request, those in `down` 404 to all of them.
+class FixtureServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, root, flaky=()):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), FixtureHandler)
+        self.root = root
+        self.pages = len(os.listdir(os.path.join(root, 'nonograms', 'p')))
+        self.flaky = set(flaky)
+        self.down = set()
+        self.hits = {}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/' % self.server_address[1]
+
+    def hit(self, path):
+        with self.lock:
+            self.hits[path] = self.hits.get(path, 0) + 1
+            return self.hits[path]
+
+    def page(self, path):
+        count = self.hit(path)
+        listing = LISTING.match(path)
+        if listing:
+            page = min(int(listing.group(1)), self.pages)
+            return 200, self.read('nonograms/p/%d/sort/6' % page)
+        puzzle = PUZZLE.match(path)
+        if puzzle:
+            nid = puzzle.group(1)
+            if nid in self.down or (nid in self.flaky and count == 1):
+                return (404 if nid in self.down else 503), 'Unavailable'
+            return 200, self.read('nonograms/i/%s' % nid)
+        return 404, 'Not found'
+
+    def read(self, path):
+        with open(os.path.join(self.root, path), 'rb') as f:
+            return f.read()
+
+class FixtureHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        status, body = self.server.page(self.path)
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Runs discover and sync against the fixtures: some puzzle pages fail once
+# and have to be retried, and some are down for the first sync, which is
+# also cut short in the middle of storing a puzzle. The second sync has to
+# fetch only what's missing and end up with every puzzle.
+def check(jobs):
+    with open(os.path.join(FIXTURES_PATH, 'expected.json'), 'r') as f:
+        expected = json.load(f)
+    nids = sorted(expected)
+    server = FixtureServer(FIXTURES_PATH, flaky=nids[::4])
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    work_dir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        os.mkdir('data')
+        fetcher = scrape.Fetcher(jobs=jobs, backoff=0.01)
+
+        scrape.NonogramDiscovery(fetcher, server.url).discover_all()
+        with open(scrape.INDEX_PATH, 'r') as f:
+            index = json.load(f)
+        assert sorted(index) == nids, 'discovered %s' % sorted(index)
+        for nid, params in index.items():
+            assert (params['width'], params['height']) == (len(expected[nid][0]),
+                                                           len(expected[nid])), nid
+
+        server.down = set(nids[-3:])
+        scrape.NonogramSync(fetcher, server.url).sync()
+        saved = JsonLinesGridData(NONOGRAMS_PATH)
+        synced = sorted(nid for nid in nids if nid in saved)
+        assert synced == nids[:-3], 'synced %s' % synced
+        saved.close()
+        for nid in server.flaky - server.down:
+            assert server.hits['/nonograms/i/%s' % nid] == 2, 'retried %s' % nid
+        # As if the sync had been killed while writing a line
+        with open(NONOGRAMS_PATH, 'ab') as f:
+            f.write('{"rows":[[1]],"id":"%s"' % nids[-1])
+
+        server.down = set()
+        hits = dict(server.hits)
+        scrape.NonogramSync(fetcher, server.url).sync()
+        fetched = sorted(path for path, count in server.hits.items()
+                         if count > hits.get(path, 0))
+        assert fetched == ['/nonograms/i/%s' % nid for nid in nids[-3:]], 'fetched %s' % fetched
+        saved = JsonLinesGridData(NONOGRAMS_PATH)
+        assert len(saved) == len(nids) and saved.superseded() == 0
+        for nid in nids:
+            assert saved.get(nid).solution == expected[nid], 'solution of %s' % nid
+        saved.close()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir)
+        server.shutdown()
+    print('Discovered and synced %s fixture puzzles with %s jobs' % (len(nids), jobs))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Check the scraper against a local server with fixture pages.')
+    parser.add_argument('-j', '--jobs',
+                        default=4,
+                        type=int,
+                        help='concurrent requests (default: 4)')
+    args = parser.parse_args()
+    try:
+        check(args.jobs)
+    except AssertionError as e:
+        print('Failed: %s' % e)
+        sys.exit(1)
@@ -0,0 +1,114 @@
+import json
+import sys
+import time
+
+from nonograms.nonogram import Grid
+from nonograms.parallel import WorkerPool
+from nonograms.util import InconsistencyException, TimeoutException
+from nonograms.solve import create_problem, count_solutions
+from benchmark import line_cache, KILL_TIMEOUT_FACTOR
+
+# Solves puzzles read as JSON lines, e.g.
+#   {"id": 1, "rows": [[1], [1, 1]], "columns": [[2], [1]]}
+# and writes one JSON line per puzzle as soon as it is done, in whatever
+# order they finish:
+#   {"id": 1, "status": "solved", "grid": [[1, 0], [1, 1]], "time": ..., ...}
+# The status is solved, timeout, contradiction (no solution) or error.
+# Input is only read as workers free up, so memory use doesn't grow with
+# the length of the stream.
+class PuzzleService:
+    def __init__(self, input=sys.stdin, output=sys.stdout, jobs=1, timeout=None,
+                 cache_size=None, count=None, **options):
+        self.input = input
+        self.output = output
+        self.jobs = jobs
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.count = count
+        self.options = options
+
+    def run(self):
+        tasks = ((request.get('id'), (request, self.timeout, self.cache_size, self.count,
+                                      self.options))
+                 for request in self.requests())
+        if self.jobs > 1:
+            pool = WorkerPool(solve_request, self.jobs,
+                              timeout=(self.timeout * KILL_TIMEOUT_FACTOR + 1
+                                       if self.timeout else None))
+            for nid, response in pool.imap_unordered(tasks):
+                self.write(response or { 'id': nid, 'status': 'timeout' })
+        else:
+            for _, args in tasks:
+                self.write(solve_request(*args))
+
+    def requests(self):
+        # Not `for line in input`, which reads ahead in blocks
+        for line in iter(self.input.readline, ''):
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError('expected an object')
+            except ValueError as e:
+                self.write({ 'status': 'error', 'error': 'Bad request: %s' % e })
+                continue
+            yield request
+
+    def write(self, response):
+        self.output.write(json.dumps(response) + '\n')
+        self.output.flush()
+
+
+def solve_request(request, timeout, cache_size, count, options):
+    try:
+        check_clues(request, 'rows')
+        check_clues(request, 'columns')
+        grid = Grid(len(request['columns']), len(request['rows']),
+                    rows=request['rows'], columns=request['columns'], nid=request.get('id'))
+    except (TypeError, KeyError, ValueError) as e:
+        return { 'id': request.get('id'), 'status': 'error', 'error': 'Bad request: %s' % e }
+    try:
+        return solve_grid(grid, timeout, cache_size, count, options)
+    except Exception as e:
+        # Whatever went wrong, it's only this puzzle that failed
+        return { 'id': grid.nid, 'status': 'error', 'error': '%s: %s' % (type(e).__name__, e) }
+
+# Each clue is a list of run lengths, empty for a blank line
+def check_clues(request, key):
+    if key not in request:
+        raise KeyError(key)
+    clues = request[key]
+    if not isinstance(clues, list) or not clues:
+        raise ValueError('%s should be a non-empty list of clues' % key)
+    for clue in clues:
+        if not isinstance(clue, list) or not all(
+                isinstance(run, (int, long)) and not isinstance(run, bool) and run > 0
+                for run in clue):
+            raise ValueError('%s should be lists of positive whole numbers, not %s' % (
+                key, json.dumps(clue)))
+
+def solve_grid(grid, timeout, cache_size, count, options):
+    # Workers keep their line cache across requests
+    problem = create_problem(grid, line_cache=line_cache(cache_size, True), **options)
+    response = { 'id': grid.nid }
+    start_time = time.clock()
+    abort_time = start_time + timeout if timeout else None
+    try:
+        if count is not None:
+            response['solutions'] = count_solutions(problem, limit=count, abort_time=abort_time)
+            if not response['solutions']:
+                raise InconsistencyException()
+        else:
+            problem.solve(abort_time=abort_time)
+        response['status'] = 'solved'
+        response['grid'] = grid.grid
+    except TimeoutException:
+        response['status'] = 'timeout'
+    except InconsistencyException:
+        response['status'] = 'contradiction'
+    response['time'] = time.clock() - start_time
+    response['branching_attempts'] = problem.branching_attempts
+    response['line_solves'] = problem.line_solves
+    response['steps'] = problem.steps
+    return response